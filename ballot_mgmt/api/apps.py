@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+    
+    # Contract artifacts are read and validated once when the process starts
+    def ready(self):
+        from .contract import load_registry
+        load_registry()
+        
+        # Persistent connections are checked before each request uses them
+        from .database import close_unusable_connections, needs_health_checks
+        if needs_health_checks():
+            request_started.connect(close_unusable_connections, dispatch_uid='api.close_unusable_connections')
@@ -0,0 +1,122 @@
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import JsonResponse
+from django.utils.timezone import now as timezone_now
+from rest_framework import renderers, response
+
+from .cache import cache_response, get_ballot_scope, get_ballot_timeout, get_cache_key, get_cached_response
+from .conditional import FINISHED, get_ballot_etag, get_ballot_last_modified, get_ballot_phase, get_not_modified_response, set_conditional_headers
+from .models import BallotBox, Candidate
+from .replicas import choose_read_database, read_from
+from .results import async_get_ballot_results
+from .serializers import BallotBoxRetrieveSerializer, CandidateListSerializer
+from .views import BallotBoxView, CandidateView
+
+# Views of the viewsets, used for everything the async views don't serve
+ballot_detail_view = BallotBoxView.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'})
+candidate_list_view = CandidateView.as_view({'get': 'list', 'post': 'create'})
+
+
+# Async views only serve JSON reads, the browsable API and writes are left to the viewsets
+def is_json_read(request):
+    return (
+        request.method == 'GET'
+        and request.GET.get('format', 'json') == 'json'
+        and 'text/html' not in request.headers.get('Accept', '')
+    )
+
+# Async views aren't DRF views, so their responses have to be rendered here
+def render_json(drf_response):
+    if not isinstance(drf_response, response.Response):
+        return drf_response
+    
+    drf_response.accepted_renderer = renderers.JSONRenderer()
+    drf_response.accepted_media_type = 'application/json'
+    drf_response.renderer_context = {}
+    
+    return drf_response.render()
+
+def get_cached_json_response(request, cache_key):
+    return render_json(get_cached_response(request, cache_key))
+
+def load_candidates(ballot):
+    prefetch_related_objects([ballot], Prefetch('candidate_set', queryset=Candidate.objects.select_related('candidate_result', 'live_tally').order_by('pk_inside_ballot')))
+    
+    return list(ballot.candidate_set.all())
+
+def build_ballot_response(ballot, results, etag, last_modified, cache_key):
+    serializer = BallotBoxRetrieveSerializer(ballot, context={'results': results})
+    retrieve_response = set_conditional_headers(response.Response(serializer.data), etag, last_modified, immutable=get_ballot_phase(ballot) == FINISHED)
+    
+    return render_json(cache_response(cache_key, retrieve_response, get_ballot_timeout(ballot, timezone_now())))
+
+def build_candidate_list_response(request, ballot, etag, last_modified, cache_key):
+    candidates = Candidate.objects.filter(ballot_parent_id=ballot.id).order_by('pk_inside_ballot')
+    serializer = CandidateListSerializer(candidates, many=True, context={'request': request})
+    list_response = set_conditional_headers(response.Response(serializer.data), etag, last_modified)
+    
+    return render_json(cache_response(cache_key, list_response, get_ballot_timeout(ballot, timezone_now())))
+
+# Same as BallotBoxView.retrieve, but results not stored yet are read from the chain concurrently
+# instead of blocking a worker thread while they arrive
+async def ballot_detail(request, pk):
+    if not is_json_read(request):
+        return await sync_to_async(ballot_detail_view)(request, pk=str(pk))
+    
+    alias = await sync_to_async(choose_read_database)(request, get_ballot_scope(pk))
+    with read_from(alias):
+        return await get_ballot_detail(request, pk)
+
+async def get_ballot_detail(request, pk):
+    cache_key = await sync_to_async(get_cache_key)(request, get_ballot_scope(pk))
+    cached_response = await sync_to_async(get_cached_json_response)(request, cache_key)
+    if cached_response is not None:
+        return cached_response
+    
+    ballot = await sync_to_async(BallotBox.objects.filter(id=pk).first)()
+    if ballot is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    
+    etag = get_ballot_etag(ballot)
+    last_modified = get_ballot_last_modified(ballot)
+    not_modified = get_not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    
+    candidates = await sync_to_async(load_candidates)(ballot)
+    results = await async_get_ballot_results(ballot, candidates)
+    
+    return await sync_to_async(build_ballot_response)(ballot, results, etag, last_modified, cache_key)
+
+# Same as CandidateView.list
+async def candidate_list(request, bk):
+    if not is_json_read(request):
+        return await sync_to_async(candidate_list_view)(request, bk=str(bk))
+    
+    alias = await sync_to_async(choose_read_database)(request, get_ballot_scope(bk))
+    with read_from(alias):
+        return await get_candidate_list(request, bk)
+
+async def get_candidate_list(request, bk):
+    cache_key = await sync_to_async(get_cache_key)(request, get_ballot_scope(bk))
+    cached_response = await sync_to_async(get_cached_json_response)(request, cache_key)
+    if cached_response is not None:
+        return cached_response
+    
+    ballot = await sync_to_async(BallotBox.objects.only('id', 'start_datetime', 'end_datetime', 'version', 'updated_datetime').filter(id=bk).first)()
+    if ballot is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    
+    etag = get_ballot_etag(ballot)
+    last_modified = get_ballot_last_modified(ballot)
+    not_modified = get_not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    
+    return await sync_to_async(build_candidate_list_response)(request, ballot, etag, last_modified, cache_key)
+
+# Writes are passed to the viewsets, which are exempt from the CSRF middleware and check CSRF themselves when the
+# request is authenticated by session, so these views have to be exempt too. csrf_exempt can't wrap a coroutine in
+# this Django version, so the flag it sets is set directly
+ballot_detail.csrf_exempt = True
+candidate_list.csrf_exempt = True
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .chain import create_async_web3, create_endpoint_pool, create_web3
+
+import os
+
+INFURA_URL = 'https://polygon-mumbai.infura.io/v3/'
+LOCAL_NODE_URL = 'http://127.0.0.1:8545'
+# First prefunded account of anvil and hardhat development nodes, whose key is public
+LOCAL_NODE_ACCOUNT_KEY = '0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80'
+
+
+# Chain reached through one or more JSON-RPC nodes over HTTP (WEB3_PROVIDER_URLS). With several nodes, requests
+# go to the fastest healthy one and fail over to the others. The sync and async clients share the endpoint stats
+class HTTPBackend:
+    def __init__(self):
+        self.endpoint_pool = None
+    
+    def get_provider_urls(self):
+        if not settings.WEB3_PROVIDER_URLS:
+            raise ImproperlyConfigured('WEB3_PROVIDER_URLS must be set to use ' + type(self).__name__)
+        
+        return settings.WEB3_PROVIDER_URLS
+    
+    def get_endpoint_pool(self):
+        if self.endpoint_pool is None:
+            self.endpoint_pool = create_endpoint_pool(self.get_provider_urls())
+        
+        return self.endpoint_pool
+    
+    def create_web3(self):
+        return create_web3(self.get_endpoint_pool())
+    
+    def create_async_web3(self):
+        return create_async_web3(self.get_endpoint_pool())
+    
+    def get_account_key(self):
+        return os.environ['ACCOUNT_KEY']
+
+# Polygon Mumbai through Infura, with the nodes in WEB3_PROVIDER_URLS (if any) as fallbacks
+class InfuraBackend(HTTPBackend):
+    def get_provider_urls(self):
+        return [INFURA_URL + os.environ['INFURA_API_KEY']] + settings.WEB3_PROVIDER_URLS
+
+# Local development node (anvil or hardhat node) shared by every process, so the app servers, the deployer and the
+# poller see the same chain and the whole deploy, vote and count path can be run (and load tested) through the app.
+# It's reached at WEB3_PROVIDER_URLS (the default port of this host if empty), and transactions are sent from
+# ACCOUNT_KEY or the first prefunded account of the node
+class LocalNodeBackend(HTTPBackend):
+    def get_provider_urls(self):
+        return settings.WEB3_PROVIDER_URLS or [LOCAL_NODE_URL]
+    
+    def get_account_key(self):
+        return os.environ.get('ACCOUNT_KEY') or LOCAL_NODE_ACCOUNT_KEY
+
+# In-process chain (eth-tester with py-evm), so the whole deploy, vote and count path can run without network.
+# Every process has its own chain, which is lost when the process exits, so it only fits tests and single process
+# runs: the API, deploy_worker and poll_tallies need LocalNodeBackend to share a chain. Transactions are sent from
+# its first (prefunded) account and mined as soon as they are sent
+class TesterBackend:
+    def __init__(self):
+        self.provider = None
+    
+    def create_web3(self):
+        # Only needed by this backend, so it isn't required by the others (pip install -r requirements-dev.txt)
+        from web3 import EthereumTesterProvider, Web3
+        
+        self.provider = EthereumTesterProvider()
+        return Web3(self.provider)
+    
+    def create_async_web3(self):
+        return None
+    
+    def get_account_key(self):
+        if self.provider is None:
+            raise ImproperlyConfigured('The tester chain is created along with its Web3 client')
+        
+        return self.provider.ethereum_tester.backend.account_keys[0].to_hex()
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from rest_framework import response
+
+import hashlib
+
+BALLOT_LIST_SCOPE = 'ballot-list'
+
+
+def get_ballot_scope(ballot_id):
+    return 'ballot-' + str(ballot_id)
+
+# Every scope has a generation number that is part of the keys of its responses.
+# Increasing it invalidates every cached response of the scope, whatever its query parameters were
+def get_generation(scope):
+    return cache.get_or_set('api:generation:' + scope, 1, timeout=None)
+
+# The scope is also read from the primary database for a while, so a replica that hasn't received the change yet
+# can't get its old data cached under the new generation
+def invalidate(scope):
+    try:
+        cache.incr('api:generation:' + scope)
+    except ValueError:
+        cache.set('api:generation:' + scope, 1, timeout=None)
+    
+    if settings.DATABASE_REPLICAS:
+        cache.set('api:primary:' + scope, 1, timeout=settings.DATABASE_REPLICA_PIN_SECONDS)
+
+def is_pinned_to_primary(scope):
+    return cache.get('api:primary:' + scope) is not None
+
+# A change of a ballot (or its candidates) invalidates its responses, and the ballot list when it changed a listed field
+def invalidate_ballot(ballot_id, listed=True):
+    invalidate(get_ballot_scope(ballot_id))
+    if listed:
+        invalidate(BALLOT_LIST_SCOPE)
+
+# The key is taken before reading the database, so a change made meanwhile can't be cached under the new generation
+def get_cache_key(request, scope):
+    url_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    
+    return 'api:response:' + scope + ':' + str(get_generation(scope)) + ':' + url_hash
+
+# The serialized data is cached instead of the rendered response, so each client still gets the format it asked for.
+# A cached ETag also lets conditional requests be answered with a 304 without touching the database
+def get_cached_response(request, key):
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    
+    data, headers = cached
+    not_modified = get_conditional_response(request, etag=headers.get('ETag'))
+    if not_modified is not None:
+        not_modified['ETag'] = headers['ETag']
+        return not_modified
+    
+    return response.Response(data, headers=headers)
+
+def cache_response(key, cached_response, timeout):
+    if cached_response.status_code == 200 and timeout > 0:
+        headers = {header: cached_response[header] for header in ['ETag', 'Last-Modified', 'Cache-Control'] if cached_response.has_header(header)}
+        cache.set(key, (cached_response.data, headers), timeout)
+    
+    return cached_response
+
+# Active ballots change on chain, so they are only cached for a short time. Other ballots are cached until they start or
+# their results are final
+def get_ballot_timeout(ballot, now):
+    if ballot.start_datetime > now:
+        return min(settings.API_CACHE_TIMEOUT, int((ballot.start_datetime - now).total_seconds()))
+    if ballot.get_final_datetime() >= now:
+        return min(settings.API_CACHE_ACTIVE_TIMEOUT, int((ballot.get_final_datetime() - now).total_seconds()))
+    
+    return settings.API_CACHE_TIMEOUT
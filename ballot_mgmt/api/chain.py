@@ -0,0 +1,349 @@
+from web3 import Web3, HTTPProvider
+from web3.eth import AsyncEth
+from web3.exceptions import TransactionNotFound
+from web3.middleware import geth_poa_middleware
+from web3.providers.async_rpc import AsyncHTTPProvider
+from hexbytes import HexBytes
+
+from .contract import get_artifact
+from .endpoints import EndpointPool
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+import aiohttp
+import asyncio
+import json
+import requests
+import threading
+import time
+import weakref
+
+_backend = None
+_web3 = None
+_web3_lock = threading.Lock()
+_async_web3 = None
+
+
+# HTTP provider that sends every request through the given session instead of web3's per-thread sessions,
+# so all the threads of the process share the same keep-alive connection pool (and pay the TLS handshake once)
+class PooledHTTPProvider(HTTPProvider):
+    def __init__(self, endpoint_uri, session, request_kwargs=None):
+        super().__init__(endpoint_uri, request_kwargs)
+        self.session = session
+    
+    def make_request(self, method, params):
+        return self.decode_rpc_response(self.post(self.encode_rpc_request(method, params)))
+    
+    # Sends an encoded JSON-RPC request (or batch) and returns the raw response
+    def post(self, request_data):
+        raw_response = self.session.post(self.endpoint_uri, data=request_data, **self.get_request_kwargs())
+        raw_response.raise_for_status()
+        
+        return raw_response.content
+
+# Pooled provider that sends every request to the best endpoint of the pool, and to the next ones if it fails
+# (connection errors, timeouts and error statuses such as 429 when rate limited)
+class FailoverHTTPProvider(PooledHTTPProvider):
+    def __init__(self, endpoint_pool, session, request_kwargs=None):
+        super().__init__(endpoint_pool.endpoints[0].url, session, request_kwargs)
+        self.endpoint_pool = endpoint_pool
+    
+    def post(self, request_data):
+        for endpoint in self.endpoint_pool.get_endpoints():
+            started = time.monotonic()
+            try:
+                raw_response = self.session.post(endpoint.url, data=request_data, **self.get_request_kwargs())
+                raw_response.raise_for_status()
+            except requests.RequestException as e:
+                self.endpoint_pool.record_failure(endpoint)
+                error = e
+                continue
+            
+            self.endpoint_pool.record_success(endpoint, time.monotonic() - started)
+            return raw_response.content
+        
+        raise error
+
+def create_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=settings.WEB3_POOL_SIZE, pool_maxsize=settings.WEB3_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    
+    return session
+
+def create_endpoint_pool(urls):
+    return EndpointPool(urls, settings.WEB3_EJECT_BACKOFF, settings.WEB3_EJECT_MAX_BACKOFF)
+
+def create_web3(endpoint_pool):
+    w3 = Web3(FailoverHTTPProvider(endpoint_pool, create_session(), {'timeout': settings.WEB3_TIMEOUT}))
+    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+    
+    return w3
+
+# Returns the chain backend chosen in the WEB3_BACKEND setting (see api.backends)
+def get_backend():
+    global _backend
+    
+    if _backend is None:
+        with _web3_lock:
+            if _backend is None:
+                _backend = import_string(settings.WEB3_BACKEND)()
+    
+    return _backend
+
+# Returns the Web3 client of the process, which is built by the backend only the first time
+def get_web3():
+    global _web3
+    
+    if _web3 is None:
+        backend = get_backend()
+        with _web3_lock:
+            if _web3 is None:
+                _web3 = backend.create_web3()
+    
+    return _web3
+
+# Returns the account transactions are sent from
+def get_admin_account(w3):
+    return w3.eth.account.privateKeyToAccount(get_backend().get_account_key())
+
+# Async version of PooledHTTPProvider. aiohttp sessions can only be used from the event loop they were created in,
+# so there is a session (with its own connection pool) for every event loop of the process
+class PooledAsyncHTTPProvider(AsyncHTTPProvider):
+    def __init__(self, endpoint_uri, request_kwargs=None):
+        super().__init__(endpoint_uri, request_kwargs)
+        # Session of every loop along with the generator that closes it
+        self.sessions = weakref.WeakKeyDictionary()
+    
+    # The ASGI server runs a single loop for the whole process, but async views served by WSGI (and by the test
+    # client) run on a new loop for every request, so sessions are closed when their loop ends instead of leaking
+    # their connections. asyncio.run (used by async_to_sync) closes the async generators of a loop before closing it
+    def get_session(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.sessions:
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=settings.WEB3_POOL_SIZE), raise_for_status=True)
+            closer = close_on_shutdown(session)
+            asyncio.ensure_future(closer.__anext__())
+            self.sessions[loop] = (session, closer)
+        
+        return self.sessions[loop][0]
+    
+    async def make_request(self, method, params):
+        return self.decode_rpc_response(await self.post(self.encode_rpc_request(method, params)))
+    
+    async def post(self, request_data):
+        async with self.get_session().post(self.endpoint_uri, data=request_data, **self.get_request_kwargs()) as raw_response:
+            return await raw_response.read()
+
+# Waits until its loop shuts down its async generators, then closes the session
+async def close_on_shutdown(session):
+    try:
+        yield
+    finally:
+        await session.close()
+
+# Async version of FailoverHTTPProvider, which can share the endpoint pool with the sync one
+class FailoverAsyncHTTPProvider(PooledAsyncHTTPProvider):
+    def __init__(self, endpoint_pool, request_kwargs=None):
+        super().__init__(endpoint_pool.endpoints[0].url, request_kwargs)
+        self.endpoint_pool = endpoint_pool
+    
+    async def post(self, request_data):
+        for endpoint in self.endpoint_pool.get_endpoints():
+            started = time.monotonic()
+            try:
+                async with self.get_session().post(endpoint.url, data=request_data, **self.get_request_kwargs()) as raw_response:
+                    content = await raw_response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.endpoint_pool.record_failure(endpoint)
+                error = e
+                continue
+            
+            self.endpoint_pool.record_success(endpoint, time.monotonic() - started)
+            return content
+        
+        raise error
+
+def create_async_web3(endpoint_pool):
+    return Web3(
+        FailoverAsyncHTTPProvider(endpoint_pool, {'timeout': aiohttp.ClientTimeout(total=settings.WEB3_TIMEOUT)}),
+        modules={'eth': (AsyncEth,)},
+        middlewares=[]
+    )
+
+# Returns the async Web3 client of the process, used by the async views, or None if the backend has no async client
+def get_async_web3():
+    global _async_web3
+    
+    if _async_web3 is None:
+        backend = get_backend()
+        with _web3_lock:
+            if _async_web3 is None:
+                _async_web3 = backend.create_async_web3()
+    
+    return _async_web3
+
+# Tests can switch the backend with override_settings, which has to drop the clients of the previous one
+@receiver(setting_changed)
+def reset_web3(setting, **kwargs):
+    global _backend, _web3, _async_web3
+    
+    if setting in ('WEB3_BACKEND', 'WEB3_PROVIDER_URLS'):
+        with _web3_lock:
+            _backend = None
+            _web3 = None
+            _async_web3 = None
+
+# Sends every (method, params) request in a single JSON-RPC batch and returns their raw results in the same order
+def batch_request(w3, rpc_requests):
+    if not rpc_requests:
+        return []
+    
+    payload = [
+        {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}
+        for request_id, (method, params) in enumerate(rpc_requests)
+    ]
+    
+    results = [None] * len(rpc_requests)
+    for rpc_response in json.loads(w3.provider.post(json.dumps(payload).encode())):
+        if 'error' in rpc_response:
+            raise ValueError(rpc_response['error'])
+        
+        results[rpc_response['id']] = rpc_response['result']
+    
+    return results
+
+# Sends every call in a single JSON-RPC batch request and returns the decoded outputs in the same order.
+# Each call is a (function name, args) tuple of the given contract
+def batch_call(w3, contract, calls, block_identifier='latest'):
+    if not calls:
+        return []
+    
+    # Providers without an HTTP session (the in-process tester chain) have no round trips to save
+    if not isinstance(w3.provider, PooledHTTPProvider):
+        return [contract.get_function_by_name(fn_name)(*args).call(block_identifier=block_identifier) for fn_name, args in calls]
+    
+    rpc_requests = []
+    output_types = []
+    for fn_name, args in calls:
+        function = contract.get_function_by_name(fn_name)
+        rpc_requests.append(('eth_call', [
+            {'to': contract.address, 'data': contract.encodeABI(fn_name=fn_name, args=args)},
+            hex(block_identifier) if isinstance(block_identifier, int) else block_identifier,
+        ]))
+        output_types.append([output['type'] for output in function.abi['outputs']])
+    
+    outputs = []
+    for types, result in zip(output_types, batch_request(w3, rpc_requests)):
+        decoded = w3.codec.decode_abi(types, HexBytes(result))
+        outputs.append(decoded[0] if len(decoded) == 1 else decoded)
+    
+    return outputs
+
+# Reads the receipts of every given transaction with a single round trip. Returns them by hash (as hex),
+# with None for the transactions not mined yet. Only the fields the pipeline uses are decoded
+def get_transaction_receipts(w3, txn_hashes):
+    if not isinstance(w3.provider, PooledHTTPProvider):
+        receipts = {}
+        for txn_hash in txn_hashes:
+            try:
+                receipts[txn_hash] = w3.eth.get_transaction_receipt(txn_hash)
+            except TransactionNotFound:
+                receipts[txn_hash] = None
+        return receipts
+    
+    raw_receipts = batch_request(w3, [('eth_getTransactionReceipt', [txn_hash]) for txn_hash in txn_hashes])
+    
+    receipts = {}
+    for txn_hash, raw_receipt in zip(txn_hashes, raw_receipts):
+        receipts[txn_hash] = None if raw_receipt is None else {
+            'transactionHash': txn_hash,
+            'blockNumber': int(raw_receipt['blockNumber'], 16),
+            'status': int(raw_receipt['status'], 16),
+            'contractAddress': Web3.toChecksumAddress(raw_receipt['contractAddress']) if raw_receipt.get('contractAddress') else None,
+        }
+    
+    return receipts
+
+# Reads which of the given transactions the node knows (pending or mined) and how many transactions each of the given
+# accounts has, mined and with the pending ones (which only counts those without a gap before them), with a single
+# round trip. Returns the set of known hashes and the (mined, pending) counts by address
+def get_transaction_states(w3, txn_hashes, addresses):
+    if not isinstance(w3.provider, PooledHTTPProvider):
+        known_hashes = set()
+        for txn_hash in txn_hashes:
+            try:
+                w3.eth.get_transaction(txn_hash)
+                known_hashes.add(txn_hash)
+            except TransactionNotFound:
+                pass
+        return known_hashes, {address: (w3.eth.get_transaction_count(address), w3.eth.get_transaction_count(address, 'pending')) for address in addresses}
+    
+    results = batch_request(w3, [('eth_getTransactionByHash', [txn_hash]) for txn_hash in txn_hashes] + [('eth_getTransactionCount', [address, block]) for address in addresses for block in ('latest', 'pending')])
+    
+    known_hashes = {txn_hash for txn_hash, raw_txn in zip(txn_hashes, results) if raw_txn is not None}
+    raw_counts = results[len(txn_hashes):]
+    counts = {address: (int(raw_counts[2 * index], 16), int(raw_counts[2 * index + 1], 16)) for index, address in enumerate(addresses)}
+    
+    return known_hashes, counts
+
+# Sends every call as its own request, all of them at the same time (up to WEB3_CONCURRENCY at once),
+# and returns the decoded outputs in the same order. The contract (of a sync client) is only used to encode the calls
+async def async_call(w3, contract, calls, block_identifier='latest'):
+    semaphore = asyncio.Semaphore(settings.WEB3_CONCURRENCY)
+    
+    async def call(fn_name, args):
+        function = contract.get_function_by_name(fn_name)
+        async with semaphore:
+            raw_output = await w3.eth.call({'to': contract.address, 'data': contract.encodeABI(fn_name=fn_name, args=args)}, block_identifier)
+        
+        decoded = w3.codec.decode_abi([output['type'] for output in function.abi['outputs']], raw_output)
+        return decoded[0] if len(decoded) == 1 else decoded
+    
+    return list(await asyncio.gather(*[call(fn_name, args) for fn_name, args in calls]))
+
+# Reads the vote count of every given position inside the ballot with a single round trip
+def read_vote_counts(contract_address, positions, timestamp, contract_version=None):
+    w3 = get_web3()
+    contract = get_artifact(contract_version).get_contract(w3, contract_address)
+    
+    counts = batch_call(w3, contract, [('getProposalVoteCount', [position, timestamp]) for position in positions])
+    
+    return dict(zip(positions, counts))
+
+# Reads the vote counts at the latest block, returning the block number too so they can be stamped with it
+def read_vote_counts_at_latest_block(contract_address, positions, timestamp, contract_version=None):
+    w3 = get_web3()
+    contract = get_artifact(contract_version).get_contract(w3, contract_address)
+    
+    block_number = w3.eth.block_number
+    counts = batch_call(w3, contract, [('getProposalVoteCount', [position, timestamp]) for position in positions], block_number)
+    
+    return block_number, dict(zip(positions, counts))
+
+# Reads the (name, position, vote count) tuple stored on chain for every given index with a single round trip
+def read_proposals(contract_address, indexes, contract_version=None):
+    w3 = get_web3()
+    contract = get_artifact(contract_version).get_contract(w3, contract_address)
+    
+    proposals = batch_call(w3, contract, [('proposals', [index]) for index in indexes])
+    
+    return dict(zip(indexes, proposals))
+
+# Async version of read_vote_counts, with a request per position sent concurrently
+async def async_read_vote_counts(contract_address, positions, timestamp, contract_version=None):
+    async_w3 = get_async_web3()
+    # Backends without an async client are read with the sync one
+    if async_w3 is None:
+        return await sync_to_async(read_vote_counts)(contract_address, positions, timestamp, contract_version)
+    
+    contract = get_artifact(contract_version).get_contract(get_web3(), contract_address)
+    counts = await async_call(async_w3, contract, [('getProposalVoteCount', [position, timestamp]) for position in positions])
+    
+    return dict(zip(positions, counts))
@@ -0,0 +1,73 @@
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+import hashlib
+
+from .models import BallotBox, BallotListVersion
+
+UPCOMING = 'upcoming'
+ACTIVE = 'active'
+FINISHED = 'finished'
+
+
+# A ballot is still active (its results are the live counts) after its end, until its results are final
+def get_ballot_phase(ballot, now=None):
+    now = now or timezone.now()
+    
+    if ballot.start_datetime > now:
+        return UPCOMING
+    if ballot.get_final_datetime() >= now:
+        return ACTIVE
+    return FINISHED
+
+# The phase is part of the ETag because the results of a ballot change with it: there are none before it starts, live
+# counts while it's active and the final results once it has finished
+def get_ballot_etag(ballot):
+    return quote_etag(str(ballot.id) + '-' + str(ballot.version) + '-' + get_ballot_phase(ballot))
+
+# Starting and finishing change the responses of a ballot without saving it, so its last start or end that has passed
+# (or the time its results became final) is the last modification when it's later than the last change
+def get_ballot_last_modified(ballot, now=None):
+    now = now or timezone.now()
+    stamps = [ballot.updated_datetime, ballot.start_datetime, ballot.end_datetime, ballot.get_final_datetime()]
+    
+    return max([stamp for stamp in stamps if stamp <= now], default=ballot.updated_datetime)
+
+# A list changes when any ballot is added, changed or removed, which increases the list version, so the ETag is read
+# from a single row. Lists filtered by status also change when a ballot starts or finishes, so the last start and end
+# that have passed (each read from its index) are part of their ETag too
+def get_ballot_list_etag(request):
+    list_version = BallotListVersion.get()
+    key = str(list_version.version) + '-' + request.query_params.urlencode()
+    last_modified = list_version.updated_datetime
+    
+    if 'status' in request.query_params:
+        now = timezone.now()
+        started = BallotBox.objects.filter(start_datetime__lte=now).order_by('-start_datetime').values_list('start_datetime', flat=True).first()
+        ended = BallotBox.objects.filter(end_datetime__lt=now).order_by('-end_datetime').values_list('end_datetime', flat=True).first()
+        key += '-' + str(started) + '-' + str(ended)
+        last_modified = max([stamp for stamp in [last_modified, started, ended] if stamp is not None], default=None)
+    
+    return quote_etag(hashlib.md5(key.encode()).hexdigest()), last_modified
+
+# Returns a 304 response if the client copy is still valid, or None if the response has to be built
+def get_not_modified_response(request, etag, last_modified):
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+    
+    return not_modified
+
+def set_conditional_headers(response, etag, last_modified, immutable=False):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    
+    # Finished ballots never change again, other responses have to be revalidated with the ETag
+    if immutable:
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    
+    return response
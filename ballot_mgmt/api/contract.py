@@ -1,16 +1,103 @@
+import hashlib
 import json
+import threading
+import weakref
+from pathlib import Path
 
+# Compiled contracts live next to this file, so they are found no matter which directory the process runs from
+CONTRACT_DIR = Path(__file__).resolve().parent / 'contract'
+DEFAULT_CONTRACT_NAME = 'Ballot_sol_Ballot'
+REQUIRED_FUNCTIONS = ['getProposalVoteCount', 'proposals', 'vote']
 
-def get_abi():
-    abi_file = open('ballot_mgmt/api/contract/Ballot_sol_Ballot.abi')
-    abi_json = json.load(abi_file)
-    abi_file.close()
+_artifacts = None
+_default_version = None
+_artifacts_lock = threading.Lock()
+
+
+class ContractArtifactError(Exception):
+    pass
+
+# ABI and bytecode of a compiled contract, identified by the hash of its bytecode
+class ContractArtifact:
+    def __init__(self, name, abi, bytecode):
+        self.name = name
+        self.abi = abi
+        self.bytecode = bytecode
+        self.version = hashlib.sha256(bytecode.encode()).hexdigest()
+        self._factories = weakref.WeakKeyDictionary()
+        
+        self.validate()
+    
+    def validate(self):
+        if not isinstance(self.abi, list):
+            raise ContractArtifactError('ABI of ' + self.name + ' must be a list')
+        
+        functions = [entry.get('name') for entry in self.abi if entry.get('type') == 'function']
+        for function in REQUIRED_FUNCTIONS:
+            if function not in functions:
+                raise ContractArtifactError('ABI of ' + self.name + ' has no ' + function + ' function')
+        
+        try:
+            bytes.fromhex(self.bytecode.removeprefix('0x'))
+        except ValueError:
+            raise ContractArtifactError('Bytecode of ' + self.name + ' is not valid hex')
     
-    return abi_json
+    # Contract classes are built once per Web3 client and reused, so reads only have to bind an address
+    def get_factory(self, w3):
+        factory = self._factories.get(w3)
+        if factory is None:
+            factory = w3.eth.contract(abi=self.abi, bytecode=self.bytecode)
+            self._factories[w3] = factory
+        
+        return factory
+    
+    def get_contract(self, w3, address):
+        return self.get_factory(w3)(address=address)
 
-def get_bytecode():
-    bytecode_file = open('ballot_mgmt/api/contract/Ballot_sol_Ballot.bin')
-    bytecode_string = bytecode_file.read()
-    bytecode_file.close()
+def load_artifact(name):
+    with open(CONTRACT_DIR / (name + '.abi')) as abi_file:
+        abi = json.load(abi_file)
+    with open(CONTRACT_DIR / (name + '.bin')) as bytecode_file:
+        bytecode = bytecode_file.read().strip()
+    
+    return ContractArtifact(name, abi, bytecode)
+
+# Loads every .abi/.bin pair of the contract directory. Older contract versions can be kept there with another name,
+# so ballots deployed with them can still be read
+def load_registry():
+    global _artifacts, _default_version
     
-    return bytecode_string
+    with _artifacts_lock:
+        if _artifacts is None:
+            artifacts = {}
+            for abi_path in sorted(CONTRACT_DIR.glob('*.abi')):
+                if abi_path.with_suffix('.bin').exists():
+                    artifact = load_artifact(abi_path.stem)
+                    artifacts[artifact.version] = artifact
+            
+            default_versions = [artifact.version for artifact in artifacts.values() if artifact.name == DEFAULT_CONTRACT_NAME]
+            if not default_versions:
+                raise ContractArtifactError('Contract ' + DEFAULT_CONTRACT_NAME + ' not found in ' + str(CONTRACT_DIR))
+            
+            _default_version = default_versions[0]
+            _artifacts = artifacts
+    
+    return _artifacts
+
+# Returns the artifact with the given version, or the current one if no version is given.
+# Ballots deployed before versions were stored have no version, and were deployed with the current contract
+def get_artifact(version=None):
+    artifacts = _artifacts if _artifacts is not None else load_registry()
+    
+    if version is None:
+        return artifacts[_default_version]
+    if version not in artifacts:
+        raise ContractArtifactError('Contract version ' + version + ' not found')
+    
+    return artifacts[version]
+
+def get_abi():
+    return get_artifact().abi
+
+def get_bytecode():
+    return get_artifact().bytecode
@@ -0,0 +1,18 @@
+from django.db import connections
+
+import django
+
+
+# Closes the persistent connections that stopped working (the database restarted, or the pooler dropped them while
+# idle), so the next query opens a new connection instead of failing. Django does it by itself from 4.1 on when
+# CONN_HEALTH_CHECKS is set, this brings the same check to the version we run
+def close_unusable_connections(**kwargs):
+    for connection in connections.all():
+        if not connection.settings_dict.get('CONN_HEALTH_CHECKS') or connection.connection is None or connection.in_atomic_block:
+            continue
+        
+        if not connection.is_usable():
+            connection.close()
+
+def needs_health_checks():
+    return django.VERSION < (4, 1)
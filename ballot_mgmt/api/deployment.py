@@ -0,0 +1,150 @@
+from .contract import get_artifact
+
+from datetime import datetime
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import logging
+
+from .models import BallotBox, Candidate, DeploymentJob
+
+logger = logging.getLogger(__name__)
+
+
+# Queues a deployment of the ballot contract. If there is already a queued one for the ballot we reuse it,
+# so finalizing a ballot twice at the same time still deploys it only once
+def enqueue_deployment(ballot):
+    with transaction.atomic():
+        job = DeploymentJob.objects.select_for_update().filter(
+            ballot=ballot, status=DeploymentJob.QUEUED, claimed_datetime__isnull=True
+        ).first()
+        
+        if job is None:
+            job = DeploymentJob.objects.create(ballot=ballot)
+    
+    return job
+
+# Locks the candidates of the ballot and queues its only deployment
+def finalize_ballot(ballot):
+    ballot.finalized = True
+    ballot.save(update_fields=['finalized'])
+    
+    return enqueue_deployment(ballot)
+
+# Marks the oldest queued job as claimed and returns it, or None if there is nothing to do. Jobs claimed more than
+# DEPLOYMENT_CLAIM_TIMEOUT seconds ago and still queued are claimed again, as the worker that claimed them died.
+# The claim is a conditional UPDATE, so two workers can never claim the same job at the same time
+def claim_next_job():
+    while True:
+        expired = timezone.now() - timedelta(seconds=settings.DEPLOYMENT_CLAIM_TIMEOUT)
+        job = DeploymentJob.objects.filter(
+            Q(claimed_datetime__isnull=True) | Q(claimed_datetime__lt=expired), status=DeploymentJob.QUEUED
+        ).order_by('id').first()
+        if job is None:
+            return None
+        
+        unclaimed = Q(claimed_datetime__isnull=True) if job.claimed_datetime is None else Q(claimed_datetime=job.claimed_datetime)
+        claimed = DeploymentJob.objects.filter(unclaimed, id=job.id).update(claimed_datetime=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+# Builds the constructor transaction of the given contract with every candidate of the ballot
+def build_deployment(w3, admin_account, ballot, artifact):
+    contract = artifact.get_factory(w3)
+    
+    # Names are encoded in a single pass over the candidates, which are only read once when the ballot is finalized
+    candidates = list(Candidate.objects.filter(ballot_parent_id=ballot.id).order_by('pk_inside_ballot').values_list('name', 'pk_inside_ballot'))
+    candidateNames = [w3.toHex(text=name) for name, _ in candidates]
+    candidatesPositionInsideBallot = [pk_inside_ballot for _, pk_inside_ballot in candidates]
+    
+    return \
+        contract.constructor(
+            candidateNames,
+            candidatesPositionInsideBallot,
+            int(datetime.timestamp(ballot.end_datetime)),
+            int(datetime.timestamp(ballot.start_datetime))
+        ).buildTransaction(
+            {
+                'from': admin_account.address,
+            }
+        )
+
+# Exception messages can hold the URL of the node the request went to, API key included, so only the kind of error
+# (and the HTTP status, if any) is stored. The whole error is logged
+def describe_error(error):
+    if isinstance(error, str):
+        return error
+    
+    description = type(error).__name__
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code is not None:
+        description += ' (status ' + str(status_code) + ')'
+    
+    return description
+
+def fail_deployment_job(job, error):
+    if isinstance(error, Exception):
+        logger.error('Deployment %s for ballot %s failed', job.id, job.ballot_id, exc_info=error)
+    
+    job.status = DeploymentJob.FAILED
+    job.error = describe_error(error)[:500]
+    job.save()
+    
+    return job
+
+# Sends the deployment of a claimed job through the pipeline, which completes the job once its receipt arrives.
+# Nonces are allocated locally, so deployments can be sent back to back without waiting for each other.
+# The hash is stored before the transaction is sent, so if the worker dies before the job is marked as submitted,
+# the worker that claims it again tracks that transaction instead of deploying a second contract
+def submit_deployment_job(job, pipeline):
+    from .chain import get_admin_account
+    
+    if job.txn_hash:
+        job.status = DeploymentJob.SUBMITTED
+        job.save()
+        track_deployment_job(job, pipeline)
+        return job
+    
+    try:
+        artifact = get_artifact()
+        admin_account = get_admin_account(pipeline.w3)
+        txn = build_deployment(pipeline.w3, admin_account, job.ballot, artifact)
+        
+        job.contract_version = artifact.version
+        job.txn_hash = pipeline.submit(admin_account, txn, lambda txn_receipt: complete_deployment_job(job, txn_receipt), lambda txn_hash: store_txn_hash(job, txn_hash, txn['nonce']))
+        job.status = DeploymentJob.SUBMITTED
+        job.save()
+    except Exception as e:
+        fail_deployment_job(job, e)
+    
+    return job
+
+def store_txn_hash(job, txn_hash, nonce):
+    job.txn_hash = txn_hash
+    job.nonce = nonce
+    job.save(update_fields=['txn_hash', 'nonce', 'contract_version', 'updated_datetime'])
+
+# Jobs submitted by a previous run of the worker are tracked again
+def track_deployment_job(job, pipeline):
+    from .chain import get_admin_account
+    
+    pipeline.track(job.txn_hash, lambda txn_receipt: complete_deployment_job(job, txn_receipt), get_admin_account(pipeline.w3).address, job.nonce)
+
+# Stores the result of a submitted job, given the receipt of its transaction (None if it can't be mined anymore)
+def complete_deployment_job(job, txn_receipt):
+    if txn_receipt is None:
+        return fail_deployment_job(job, 'Deployment transaction ' + job.txn_hash + ' was dropped and its nonce used by another transaction')
+    if txn_receipt['status'] != 1:
+        return fail_deployment_job(job, 'Deployment transaction ' + job.txn_hash + ' was reverted')
+    
+    with transaction.atomic():
+        BallotBox.mark_changed(job.ballot_id, contract_address=txn_receipt['contractAddress'], contract_version=job.contract_version)
+        job.contract_address = txn_receipt['contractAddress']
+        job.status = DeploymentJob.MINED
+        job.save()
+    
+    return job
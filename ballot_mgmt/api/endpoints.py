@@ -0,0 +1,62 @@
+import threading
+import time
+
+# Weight of the last request in the rolling latency and error rate
+ALPHA = 0.2
+# How much slower an endpoint is considered for each point of error rate
+ERROR_PENALTY = 10
+
+
+# Rolling stats of a JSON-RPC endpoint
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+    
+    # Endpoints without a measured latency go first, so every endpoint gets measured
+    def get_score(self):
+        return (self.latency or 0.0) * (1 + ERROR_PENALTY * self.error_rate)
+    
+    def __repr__(self):
+        return 'Endpoint(' + self.url + ')'
+
+# Picks the endpoint every request is sent to. Requests go to the healthy endpoint with the lowest latency (raised by
+# its error rate), and an endpoint that fails is ejected for a backoff that doubles with each consecutive failure.
+# It's shared by every thread (and the async client) of the process
+class EndpointPool:
+    def __init__(self, urls, backoff=1, max_backoff=60, clock=time.monotonic):
+        if not urls:
+            raise ValueError('At least one endpoint is needed')
+        
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.lock = threading.Lock()
+    
+    # Returns the endpoints in the order they should be tried: healthy ones from the best to the worst, and then the
+    # ejected ones by the time they come back, so a request is still tried when every endpoint is failing
+    def get_endpoints(self):
+        now = self.clock()
+        
+        with self.lock:
+            healthy = sorted([endpoint for endpoint in self.endpoints if endpoint.ejected_until <= now], key=Endpoint.get_score)
+            ejected = sorted([endpoint for endpoint in self.endpoints if endpoint.ejected_until > now], key=lambda endpoint: endpoint.ejected_until)
+        
+        return healthy + ejected
+    
+    def record_success(self, endpoint, elapsed):
+        with self.lock:
+            endpoint.latency = elapsed if endpoint.latency is None else ALPHA * elapsed + (1 - ALPHA) * endpoint.latency
+            endpoint.error_rate = (1 - ALPHA) * endpoint.error_rate
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = 0.0
+    
+    def record_failure(self, endpoint):
+        with self.lock:
+            endpoint.error_rate = ALPHA + (1 - ALPHA) * endpoint.error_rate
+            endpoint.consecutive_failures += 1
+            endpoint.ejected_until = self.clock() + min(self.backoff * 2 ** (endpoint.consecutive_failures - 1), self.max_backoff)
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.chain import get_web3
+from api.database import close_unusable_connections
+from api.deployment import claim_next_job, submit_deployment_job, track_deployment_job
+from api.models import DeploymentJob
+from api.pipeline import TransactionPipeline
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued contract deployments and waits for all of them with a single receipt poll'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of deployments built and sent at the same time')
+        parser.add_argument('--poll-interval', type=float, default=2, help='Seconds between receipt polls (and queue checks when it is empty)')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty and every deployment has finished')
+    
+    def handle(self, *args, **options):
+        pipeline = TransactionPipeline(get_web3())
+        
+        # Deployments sent by a previous run that never got their receipt
+        for job in DeploymentJob.objects.filter(status=DeploymentJob.SUBMITTED):
+            track_deployment_job(job, pipeline)
+        
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            try:
+                self.work(executor, pipeline, options)
+            finally:
+                close_old_connections()
+    
+    # Claimed jobs are sent by the pool threads, and then the receipts of every pending deployment are polled from this
+    # thread. Polling only after the sends have finished makes sure a job is stored as submitted before it's completed
+    def work(self, executor, pipeline, options):
+        last_poll = 0
+        
+        while True:
+            close_unusable_connections()
+            jobs = self.claim_jobs(options['workers'])
+            for job in executor.map(lambda job: self.submit(job, pipeline), jobs):
+                self.stdout.write('Deployment ' + str(job.id) + ' for ballot ' + str(job.ballot_id) + ': ' + job.status)
+            
+            if time.monotonic() - last_poll >= options['poll_interval']:
+                last_poll = time.monotonic()
+                for job in pipeline.poll():
+                    self.stdout.write('Deployment ' + str(job.id) + ' for ballot ' + str(job.ballot_id) + ': ' + job.status)
+            close_old_connections()
+            
+            if not jobs:
+                if options['once'] and not pipeline.has_pending():
+                    return
+                time.sleep(options['poll_interval'])
+    
+    def submit(self, job, pipeline):
+        close_unusable_connections()
+        try:
+            return submit_deployment_job(job, pipeline)
+        finally:
+            close_old_connections()
+    
+    def claim_jobs(self, count):
+        jobs = []
+        while len(jobs) < count:
+            job = claim_next_job()
+            if job is None:
+                break
+            jobs.append(job)
+        
+        return jobs
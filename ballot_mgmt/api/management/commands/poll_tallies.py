@@ -0,0 +1,78 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from api.database import close_unusable_connections
+from api.models import BallotBox, Candidate
+from api.results import snapshot_results
+from api.tallies import refresh_tallies
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Keeps the vote counts of active ballots up to date, so requests never have to read them from the chain'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--min-interval', type=float, default=5, help='Seconds between reads of a ballot whose counts are changing')
+        parser.add_argument('--max-interval', type=float, default=60, help='Longest wait between reads of a ballot whose counts are not changing')
+        parser.add_argument('--near-close', type=float, default=300, help='Ballots ending within these seconds are read every min-interval')
+        parser.add_argument('--once', action='store_true', help='Read every active ballot once and exit')
+    
+    def handle(self, *args, **options):
+        # Seconds to wait before reading each ballot again and when it will be read next, by ballot id
+        intervals = {}
+        next_reads = {}
+        
+        try:
+            while True:
+                close_unusable_connections()
+                now = timezone.now()
+                # Ballots are still read after their end, until their results are final
+                final_end = now - timedelta(seconds=settings.RESULTS_FINALITY_SECONDS)
+                ballots = BallotBox.objects.filter(start_datetime__lte=now, contract_address__isnull=False, end_datetime__gte=final_end)
+                
+                for ballot in ballots:
+                    if next_reads.get(ballot.id, now) > now:
+                        continue
+                    
+                    try:
+                        changed = refresh_tallies(ballot)
+                    except Exception as e:
+                        self.stderr.write('Could not read counts of ballot ' + str(ballot.id) + ': ' + str(e))
+                        changed = False
+                    
+                    # Counts are read often while they change or the ballot is about to close, and less often otherwise
+                    if changed or (ballot.end_datetime - now).total_seconds() <= options['near_close']:
+                        interval = options['min_interval']
+                    else:
+                        interval = min(intervals.get(ballot.id, options['min_interval']) * 2, options['max_interval'])
+                    
+                    intervals[ballot.id] = interval
+                    next_reads[ballot.id] = now + timedelta(seconds=interval)
+                
+                self.store_finished_results(intervals, next_reads, now)
+                close_old_connections()
+                
+                if options['once']:
+                    return
+                time.sleep(options['min_interval'])
+        finally:
+            close_old_connections()
+    
+    # Ballots whose results have just become final get them stored and stop being polled
+    def store_finished_results(self, intervals, next_reads, now):
+        final_end = now - timedelta(seconds=settings.RESULTS_FINALITY_SECONDS)
+        finished_ballots = BallotBox.objects.filter(id__in=list(intervals), end_datetime__lt=final_end)
+        
+        for ballot in finished_ballots:
+            try:
+                snapshot_results(ballot, Candidate.objects.filter(ballot_parent=ballot).select_related('candidate_result'))
+                self.stdout.write('Stored results for ballot ' + str(ballot.id))
+            except Exception as e:
+                self.stderr.write('Could not store results of ballot ' + str(ballot.id) + ': ' + str(e))
+            
+            del intervals[ballot.id]
+            del next_reads[ballot.id]
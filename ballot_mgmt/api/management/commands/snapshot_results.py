@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import BallotBox, Candidate
+from api.results import snapshot_results
+
+
+class Command(BaseCommand):
+    help = 'Stores the final vote counts of finished ballots that have not been stored yet'
+    
+    def handle(self, *args, **options):
+        ballots = BallotBox.objects.filter(
+            end_datetime__lt=timezone.now(),
+            contract_address__isnull=False,
+            candidate__candidate_result__isnull=True,
+            candidate__isnull=False,
+        ).distinct()
+        
+        for ballot in ballots:
+            snapshot_results(ballot, Candidate.objects.filter(ballot_parent=ballot).select_related('candidate_result'))
+            self.stdout.write('Stored results for ballot ' + str(ballot.id))
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-18 08:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_remove_candidate_unique_id_for_ballot_ballot_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandidateResult',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('votes', models.PositiveBigIntegerField()),
+                ('recorded_datetime', models.DateTimeField(auto_now=True)),
+                ('candidate', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='candidate_result', to='api.candidate')),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0 on 2026-10-18 08:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_candidateresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeploymentJob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('submitted', 'Submitted'), ('mined', 'Mined'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('txn_hash', models.CharField(blank=True, max_length=66, null=True)),
+                ('contract_address', models.CharField(blank=True, max_length=44, null=True)),
+                ('error', models.CharField(blank=True, max_length=500, null=True)),
+                ('created_datetime', models.DateTimeField(auto_now_add=True)),
+                ('claimed_datetime', models.DateTimeField(blank=True, null=True)),
+                ('updated_datetime', models.DateTimeField(auto_now=True)),
+                ('ballot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deployment_jobs', to='api.ballotbox')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_deploymentjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ballotbox',
+            name='finalized',
+            field=models.BooleanField(default=False),
+        ),
+    ]
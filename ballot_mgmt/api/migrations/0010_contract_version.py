@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_ballotbox_finalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ballotbox',
+            name='contract_version',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='deploymentjob',
+            name='contract_version',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
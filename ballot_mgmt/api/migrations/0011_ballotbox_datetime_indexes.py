@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_contract_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ballotbox',
+            index=models.Index(fields=['start_datetime', 'id'], name='ballotbox_start_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ballotbox',
+            index=models.Index(fields=['end_datetime'], name='ballotbox_end_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0 on 2026-10-18 08:20
+
+from django.db import migrations, models
+
+
+# Existing ballots continue numbering after their last candidate
+def set_next_pk_inside_ballot(apps, schema_editor):
+    BallotBox = apps.get_model('api', 'BallotBox')
+    Candidate = apps.get_model('api', 'Candidate')
+    
+    for ballot in BallotBox.objects.all():
+        last_candidate = Candidate.objects.filter(ballot_parent=ballot).order_by('pk_inside_ballot').last()
+        if last_candidate is not None:
+            ballot.next_pk_inside_ballot = last_candidate.pk_inside_ballot + 1
+            ballot.save(update_fields=['next_pk_inside_ballot'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_ballotbox_datetime_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ballotbox',
+            name='next_pk_inside_ballot',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(set_next_pk_inside_ballot, migrations.RunPython.noop),
+    ]
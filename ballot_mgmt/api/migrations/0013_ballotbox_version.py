@@ -0,0 +1,24 @@
+# Generated by Django 4.0 on 2026-10-18 08:22
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_ballotbox_next_pk_inside_ballot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ballotbox',
+            name='updated_datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='ballotbox',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.0 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_ballotbox_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveTally',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('votes', models.PositiveBigIntegerField()),
+                ('block_number', models.PositiveBigIntegerField()),
+                ('updated_datetime', models.DateTimeField(auto_now=True)),
+                ('candidate', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='live_tally', to='api.candidate')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_livetally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountNonce',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('address', models.CharField(max_length=42, unique=True)),
+                ('next_nonce', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('updated_datetime', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_accountnonce'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BallotListVersion',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_datetime', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_ballotlistversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deploymentjob',
+            name='nonce',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
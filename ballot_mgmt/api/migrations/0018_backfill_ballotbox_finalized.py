@@ -0,0 +1,20 @@
+# Generated by Django 4.0 on 2026-10-18 16:05
+
+from django.db import migrations
+
+
+# Ballots deployed before finalized was added already have a contract, so their candidates can't be changed anymore
+def finalize_deployed_ballots(apps, schema_editor):
+    BallotBox = apps.get_model('api', 'BallotBox')
+    
+    BallotBox.objects.filter(contract_address__isnull=False, finalized=False).update(finalized=True)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_deploymentjob_nonce'),
+    ]
+
+    operations = [
+        migrations.RunPython(finalize_deployed_ballots, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,11 @@
+from datetime import timedelta
 from enum import auto
 from unicodedata import name
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from .cache import invalidate_ballot
 
 # Create your models here.
 
@@ -10,6 +15,89 @@ class BallotBox(models.Model):
     start_datetime = models.DateTimeField()
     end_datetime = models.DateTimeField()
     contract_address = models.CharField(max_length=44, unique=True, blank=True, null=True)
+    # Hash of the contract bytecode deployed for this ballot, used to find its ABI in the contract registry
+    contract_version = models.CharField(max_length=64, blank=True, null=True)
+    # Once finalized the contract is deployed and candidates can't be changed anymore
+    finalized = models.BooleanField(default=False)
+    # Next pk_inside_ballot to be given to a candidate of this ballot
+    next_pk_inside_ballot = models.IntegerField(default=0)
+    # Increased on every change of the ballot or its candidates, used to build ETags
+    version = models.PositiveIntegerField(default=0)
+    updated_datetime = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_datetime', 'id'], name='ballotbox_start_id_idx'),
+            models.Index(fields=['end_datetime'], name='ballotbox_end_idx'),
+        ]
+    
+    # Fields shown by the ballot list, the only ones whose changes increase the version of the list
+    LIST_FIELDS = ('name', 'start_datetime', 'end_datetime')
+    
+    # Keeps the listed values read from the database, to know on save if the list changed
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.listed_values = instance.get_listed_values()
+        
+        return instance
+    
+    def get_listed_values(self):
+        return tuple(self.__dict__.get(field) for field in self.LIST_FIELDS)
+    
+    # The version is increased by the database, so saving an instance read before another change of the ballot
+    # (a mark_changed, for example) can't take the version back to one already used by an ETag
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        listed = adding or getattr(self, 'listed_values', None) != self.get_listed_values()
+        if update_fields is not None:
+            listed = listed and not set(update_fields).isdisjoint(self.LIST_FIELDS)
+            kwargs['update_fields'] = list(update_fields) + ['version', 'updated_datetime']
+        
+        self.version = 1 if adding else models.F('version') + 1
+        self.updated_datetime = timezone.now()
+        super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=['version'])
+        if listed:
+            BallotListVersion.increase()
+            self.listed_values = self.get_listed_values()
+        transaction.on_commit(lambda: invalidate_ballot(self.id, listed=listed))
+    
+    def delete(self, *args, **kwargs):
+        ballot_id = self.id
+        deleted = super().delete(*args, **kwargs)
+        BallotListVersion.increase()
+        transaction.on_commit(lambda: invalidate_ballot(ballot_id, listed=True))
+        
+        return deleted
+    
+    # Increases the version of the ballot (used for ETags) along with the given fields with a single UPDATE, and
+    # invalidates its cached responses once the transaction is committed.
+    # The version of the list is only increased when a listed field is given, so adding candidates or counting votes
+    # never locks its row
+    @classmethod
+    def mark_changed(cls, ballot_id, **fields):
+        cls.objects.filter(id=ballot_id).update(version=models.F('version') + 1, updated_datetime=timezone.now(), **fields)
+        listed = not set(fields).isdisjoint(cls.LIST_FIELDS)
+        if listed:
+            BallotListVersion.increase()
+        transaction.on_commit(lambda: invalidate_ballot(ballot_id, listed=listed))
+    
+    # Reserves count consecutive pk_inside_ballot values and returns the first one.
+    # The UPDATE locks the ballot row until the transaction ends, so concurrent calls never get the same values.
+    # As it's only called when candidates are added, it also marks the ballot as changed
+    def allocate_pks_inside_ballot(self, count=1):
+        with transaction.atomic():
+            BallotBox.mark_changed(self.id, next_pk_inside_ballot=models.F('next_pk_inside_ballot') + count)
+            self.next_pk_inside_ballot = BallotBox.objects.filter(id=self.id).values_list('next_pk_inside_ballot', flat=True).get()
+        
+        return self.next_pk_inside_ballot - count
+    
+    # Results are only final once the votes sent before the end have had time to be mined
+    def get_final_datetime(self):
+        return self.end_datetime + timedelta(seconds=settings.RESULTS_FINALITY_SECONDS)
     
 class Candidate(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -26,4 +114,82 @@ class Candidate(models.Model):
             models.UniqueConstraint(
                 fields=['pk_inside_ballot', 'ballot_parent'], name='unique_pk_inside_ballot_ballot'
             )
-        ]
\ No newline at end of file
+        ]
+    
+    # Changing the candidates changes the ballot too (its version is used for caching)
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        BallotBox.mark_changed(self.ballot_parent_id)
+        
+        return deleted
+
+# Final vote counts are stored once the ballot has finished, so results can be served without calling the chain again
+class CandidateResult(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    candidate = models.OneToOneField(to=Candidate, on_delete=models.CASCADE, related_name='candidate_result')
+    votes = models.PositiveBigIntegerField()
+    recorded_datetime = models.DateTimeField(auto_now=True)
+
+# Contract deployments are run by the deploy_worker command instead of the request thread, this table is its queue
+class DeploymentJob(models.Model):
+    QUEUED = 'queued'
+    SUBMITTED = 'submitted'
+    MINED = 'mined'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SUBMITTED, 'Submitted'),
+        (MINED, 'Mined'),
+        (FAILED, 'Failed'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    ballot = models.ForeignKey(to=BallotBox, on_delete=models.CASCADE, related_name='deployment_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    txn_hash = models.CharField(max_length=66, blank=True, null=True)
+    # Nonce the transaction was sent with, to know when another transaction has taken it
+    nonce = models.PositiveBigIntegerField(blank=True, null=True)
+    contract_address = models.CharField(max_length=44, blank=True, null=True)
+    contract_version = models.CharField(max_length=64, blank=True, null=True)
+    error = models.CharField(max_length=500, blank=True, null=True)
+    created_datetime = models.DateTimeField(auto_now_add=True)
+    claimed_datetime = models.DateTimeField(blank=True, null=True)
+    updated_datetime = models.DateTimeField(auto_now=True)
+
+# Latest vote counts of the candidates of active ballots, refreshed by the poll_tallies command
+class LiveTally(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    candidate = models.OneToOneField(to=Candidate, on_delete=models.CASCADE, related_name='live_tally')
+    votes = models.PositiveBigIntegerField()
+    # Block the counts were read at
+    block_number = models.PositiveBigIntegerField()
+    updated_datetime = models.DateTimeField(auto_now=True)
+
+# Next nonce of every account transactions are sent from. The row is locked while a nonce is taken,
+# so every process (and thread) sending transactions gets a different one
+class AccountNonce(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    address = models.CharField(max_length=42, unique=True)
+    # Null when it has to be read from the chain again
+    next_nonce = models.PositiveBigIntegerField(blank=True, null=True)
+    updated_datetime = models.DateTimeField(auto_now=True)
+
+# Increased along with every change of any ballot (or its candidates), so the ETag of the ballot list is read from this
+# single row instead of going over the ballots
+class BallotListVersion(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_datetime = models.DateTimeField(blank=True, null=True)
+    
+    # Before the first change there's no row, which is the same as version 0
+    @classmethod
+    def get(cls):
+        return cls.objects.filter(id=1).first() or cls(id=1)
+    
+    # The row is created by the first change
+    @classmethod
+    def increase(cls):
+        changes = {'version': models.F('version') + 1, 'updated_datetime': timezone.now()}
+        if not cls.objects.filter(id=1).update(**changes):
+            cls.objects.get_or_create(id=1)
+            cls.objects.filter(id=1).update(**changes)
@@ -0,0 +1,101 @@
+from web3.exceptions import TransactionNotFound
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import AccountNonce
+
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+# Raised when sending failed but the node may have taken the transaction anyway (the requests failed, or so did
+# looking it up afterwards). Its hash is kept so the transaction can be tracked until it's mined or its nonce is taken
+class UnconfirmedTransaction(Exception):
+    def __init__(self, txn_hash):
+        super().__init__('Transaction ' + txn_hash.hex() + ' may have been sent')
+        self.txn_hash = txn_hash
+
+# Takes the next nonce of the account. The first time (or after a resync) it's the count of transactions
+# the chain has for the account, pending ones included
+def allocate_nonce(w3, address):
+    AccountNonce.objects.get_or_create(address=address)
+    
+    with transaction.atomic():
+        account_nonce = AccountNonce.objects.select_for_update().get(address=address)
+        if account_nonce.next_nonce is None:
+            account_nonce.next_nonce = w3.eth.get_transaction_count(address, 'pending')
+        
+        nonce = account_nonce.next_nonce
+        account_nonce.next_nonce += 1
+        account_nonce.save(update_fields=['next_nonce', 'updated_datetime'])
+    
+    return nonce
+
+# The next nonce will be read from the chain again
+def resync_nonce(address):
+    AccountNonce.objects.filter(address=address).update(next_nonce=None)
+
+# Returns whether the node has the transaction, pending or mined
+def is_known_transaction(w3, txn_hash):
+    try:
+        w3.eth.get_transaction(txn_hash)
+    except TransactionNotFound:
+        return False
+    
+    return True
+
+# Whether the node rejected the transaction because of its nonce: it was already used (by a mined transaction, or by
+# a pending one the transaction would have to outbid) or it's past a gap. Nodes answer with a JSON-RPC error
+# (raised by web3 as a ValueError with the error), the tester chain with its own exception
+def is_nonce_rejection(error):
+    details = error.args[0] if error.args else ''
+    message = str(details.get('message', '') if isinstance(details, dict) else details).lower()
+    
+    return 'nonce' in message or 'underpriced' in message
+
+# Signs and sends the transaction with the next nonce of the account, returning its hash.
+# When sending fails the node may still have taken the transaction (the request timed out after it did, or the
+# failover provider sent it again to another node after the first one took it), so its hash is looked up first.
+# If the node doesn't have it, a failed request sends the same transaction again, while a rejection of its nonce
+# (used already or left behind a gap) sends it again with the nonce read from the chain. Any other rejection is
+# final. If it can't be told whether the node has it (the lookup fails too), the same transaction is sent again, and
+# UnconfirmedTransaction is raised once every attempt has failed like that.
+# Whenever sending fails for good, the nonce is read from the chain again, so no gap is left behind.
+# on_signed is called with the hash of each signed transaction before it's sent, so it can be stored first
+def send_transaction(w3, account, txn, on_signed=None):
+    signed_txn = None
+    for _ in range(settings.WEB3_SEND_ATTEMPTS):
+        if signed_txn is None:
+            txn['nonce'] = allocate_nonce(w3, account.address)
+            signed_txn = account.signTransaction(txn)
+            if on_signed is not None:
+                on_signed(w3.toHex(signed_txn.hash))
+        
+        try:
+            return w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+        except Exception as e:
+            error = e
+        
+        try:
+            known = is_known_transaction(w3, signed_txn.hash)
+        except Exception:
+            logger.warning('Could not look up transaction %s after sending it failed', w3.toHex(signed_txn.hash), exc_info=True)
+            continue
+        
+        if known:
+            return signed_txn.hash
+        if isinstance(error, requests.RequestException):
+            continue
+        
+        resync_nonce(account.address)
+        if not is_nonce_rejection(error):
+            raise error
+        signed_txn = None
+    
+    resync_nonce(account.address)
+    if signed_txn is None:
+        raise error
+    raise UnconfirmedTransaction(signed_txn.hash) from error
@@ -0,0 +1,9 @@
+from rest_framework import pagination
+
+
+# Ballots are paginated by start datetime with a cursor, so every page costs the same no matter how many ballots there are
+class BallotBoxCursorPagination(pagination.CursorPagination):
+    ordering = ('start_datetime', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,39 @@
+from rest_framework import parsers, exceptions
+
+import csv
+import io
+import json
+
+
+# Turns a CSV, NDJSON or JSON array text into a list of candidate dicts
+def parse_candidate_rows(text, data_format):
+    try:
+        if data_format == 'csv':
+            # Empty CSV cells are optional fields that weren't given
+            return [
+                {key: value for key, value in row.items() if value != ''}
+                for row in csv.DictReader(io.StringIO(text))
+            ]
+        if data_format == 'ndjson':
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        if data_format == 'json':
+            rows = json.loads(text)
+            if not isinstance(rows, list):
+                raise exceptions.ParseError('Candidates must be a JSON array')
+            return rows
+    except (ValueError, csv.Error) as e:
+        raise exceptions.ParseError('Candidates could not be parsed: ' + str(e))
+    
+    raise exceptions.ParseError('Format must be json, csv or ndjson')
+
+class CSVParser(parsers.BaseParser):
+    media_type = 'text/csv'
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        return parse_candidate_rows(stream.read().decode('utf-8-sig'), 'csv')
+
+class NDJSONParser(parsers.BaseParser):
+    media_type = 'application/x-ndjson'
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        return parse_candidate_rows(stream.read().decode('utf-8'), 'ndjson')
@@ -0,0 +1,121 @@
+from web3 import Web3
+
+from .chain import get_transaction_receipts, get_transaction_states
+from .nonces import UnconfirmedTransaction, resync_nonce, send_transaction
+
+from django.conf import settings
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Sends transactions and keeps track of the pending ones. The receipts of every pending transaction are read with a
+# single batched request on each poll, instead of a polling loop per transaction. Once a transaction is mined its
+# callback is called (from poll) with the receipt, or with None once it can't be mined anymore.
+# A transaction that isn't mined after WEB3_RECEIPT_TIMEOUT seconds may still be, so it's only given up when the node
+# doesn't know it and its nonce has been used by another transaction. Until then it's still tracked
+class TransactionPipeline:
+    def __init__(self, w3, clock=time.monotonic):
+        self.w3 = w3
+        self.clock = clock
+        self.pending = {}
+        self.resynced = set()
+        self.lock = threading.Lock()
+    
+    # Signs and sends the transaction (with the next nonce of the account) and returns its hash.
+    # A transaction the node may have taken even though sending failed is tracked like any other
+    def submit(self, account, txn, callback, on_signed=None):
+        try:
+            txn_hash = Web3.toHex(send_transaction(self.w3, account, txn, on_signed))
+        except UnconfirmedTransaction as e:
+            logger.warning('Could not confirm transaction %s was sent, tracking it anyway', Web3.toHex(e.txn_hash), exc_info=True)
+            txn_hash = Web3.toHex(e.txn_hash)
+        
+        self.track(txn_hash, callback, account.address, txn['nonce'])
+        
+        return txn_hash
+    
+    # Transactions sent before (by a previous run of the process, for example) can be tracked too. Without the account
+    # and nonce they were sent with, they are never given up
+    def track(self, txn_hash, callback, address=None, nonce=None):
+        with self.lock:
+            self.pending[txn_hash] = (callback, self.clock(), address, nonce)
+    
+    def has_pending(self):
+        with self.lock:
+            return bool(self.pending)
+    
+    # Reads the receipts of every pending transaction and calls the callbacks of the finished ones, returning what they returned
+    def poll(self):
+        with self.lock:
+            pending = dict(self.pending)
+        if not pending:
+            return []
+        
+        try:
+            receipts = get_transaction_receipts(self.w3, list(pending))
+        except Exception:
+            logger.exception('Could not read the receipts of %s pending transactions', len(pending))
+            return []
+        
+        now = self.clock()
+        expired = {txn_hash: (address, nonce) for txn_hash, (_, submitted, address, nonce) in pending.items() if receipts.get(txn_hash) is None and now - submitted >= settings.WEB3_RECEIPT_TIMEOUT}
+        given_up = self.get_given_up(expired)
+        
+        results = []
+        for txn_hash, (callback, *_) in pending.items():
+            receipt = receipts.get(txn_hash)
+            if receipt is None and txn_hash not in given_up:
+                continue
+            
+            with self.lock:
+                del self.pending[txn_hash]
+                self.resynced.discard(txn_hash)
+            try:
+                results.append(callback(receipt))
+            except Exception:
+                logger.exception('Callback of transaction %s failed', txn_hash)
+        
+        return results
+    
+    # Returns the expired transactions that can't be mined anymore: the node doesn't know them and their nonce has been
+    # used by another transaction. The nonce is read from the chain again when a transaction has been dropped by the
+    # node, or when it's waiting behind a gap (its nonce is past the pending ones, so an earlier nonce never reached the
+    # node), so the next transaction of the account takes the missing nonce instead of every later one waiting
+    def get_given_up(self, expired):
+        if not expired:
+            return set()
+        
+        try:
+            known_hashes, counts = get_transaction_states(self.w3, list(expired), list({address for address, _ in expired.values() if address is not None}))
+        except Exception:
+            logger.exception('Could not check %s transactions not mined in time', len(expired))
+            return set()
+        
+        given_up = set()
+        for txn_hash, (address, nonce) in expired.items():
+            if nonce is None:
+                continue
+            
+            mined_count, pending_count = counts[address]
+            if txn_hash in known_hashes:
+                if nonce >= pending_count:
+                    self.resync(txn_hash, address, 'is waiting behind a nonce gap')
+            elif mined_count > nonce:
+                given_up.add(txn_hash)
+            else:
+                self.resync(txn_hash, address, 'was dropped by the node')
+        
+        return given_up
+    
+    # The nonce is only read again once for each transaction, so it isn't reset on every poll while it's stuck
+    def resync(self, txn_hash, address, reason):
+        if txn_hash in self.resynced:
+            return
+        
+        logger.warning('Transaction %s %s, the nonce of %s will be read from the chain again', txn_hash, reason, address)
+        self.resynced.add(txn_hash)
+        resync_nonce(address)
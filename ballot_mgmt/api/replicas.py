@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .cache import BALLOT_LIST_SCOPE, get_ballot_scope, is_pinned_to_primary
+
+import random
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Set on the responses of writes, the client reads from the primary database while it lasts
+PIN_COOKIE = 'primary_pin'
+
+# Database the current request reads from, None for the primary
+read_database = ContextVar('read_database', default=None)
+
+
+# Reads go to the replica chosen for the request, unless a transaction of the primary is open: the reads of a
+# transaction (select_for_update included) have to see its writes and lock its rows. The database cache is always read
+# from the primary too, as generations and pins have to be seen as soon as they change. Everything else uses the primary
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_database.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block or model._meta.app_label == 'django_cache':
+            return DEFAULT_DB_ALIAS
+        
+        return alias
+    
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+    
+    # Replicas hold the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+    
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+# Returns a replica for the reads of the request, or None if they must go to the primary: the client has just written
+# (so it reads its own writes) or the scope has just changed (so no stale data gets cached)
+def choose_read_database(request, scope):
+    if not settings.DATABASE_REPLICAS or PIN_COOKIE in request.COOKIES or is_pinned_to_primary(scope):
+        return None
+    
+    return random.choice(settings.DATABASE_REPLICAS)
+
+@contextmanager
+def read_from(alias):
+    token = read_database.set(alias)
+    try:
+        yield alias
+    finally:
+        read_database.reset(token)
+
+# Pins the client that has written to the primary database until the replicas have caught up
+class ReplicaPinMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        response = self.get_response(request)
+        
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        
+        return response
+
+# Read-only actions of a viewset are served from a replica. The scope is the one of the cached responses of the action
+class ReplicaReadMixin:
+    replica_actions = ('list', 'retrieve')
+    
+    def get_read_scope(self, kwargs):
+        return get_ballot_scope(kwargs['pk']) if 'pk' in kwargs else BALLOT_LIST_SCOPE
+    
+    def dispatch(self, request, *args, **kwargs):
+        alias = None
+        if self.action_map.get(request.method.lower()) in self.replica_actions:
+            alias = choose_read_database(request, self.get_read_scope(kwargs))
+        
+        with read_from(alias):
+            return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,96 @@
+from .tallies import get_live_tallies
+
+from asgiref.sync import sync_to_async
+from datetime import datetime
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Candidate, CandidateResult
+
+
+# Returns the stored results (by pk_inside_ballot) and the candidates without a stored result
+def get_stored_results(candidates):
+    results = {}
+    missing_candidates = []
+    for candidate in candidates:
+        if hasattr(candidate, 'candidate_result'):
+            results[candidate.pk_inside_ballot] = candidate.candidate_result.votes
+        else:
+            missing_candidates.append(candidate)
+    
+    return results, missing_candidates
+
+# If another request stored them first, the already stored counts are kept
+def store_results(candidates, votes):
+    with transaction.atomic():
+        CandidateResult.objects.bulk_create([
+            CandidateResult(candidate=candidate, votes=votes[candidate.pk_inside_ballot])
+            for candidate in candidates
+        ], ignore_conflicts=True)
+
+# Reads the final counts of every candidate without a stored result from the chain (in a single batch) and stores them.
+# Returns the counts of every candidate. A ballot whose contract was never deployed (it wasn't finalized in time) has
+# nothing to read, so its candidates have no counts
+def snapshot_results(ballot, candidates=None):
+    if candidates is None:
+        candidates = Candidate.objects.filter(ballot_parent=ballot).select_related('candidate_result')
+    
+    results, missing_candidates = get_stored_results(candidates)
+    if missing_candidates and ballot.contract_address is not None:
+        from .chain import read_vote_counts
+        votes = read_vote_counts(
+            ballot.contract_address,
+            [candidate.pk_inside_ballot for candidate in missing_candidates],
+            int(datetime.timestamp(timezone.now())),
+            ballot.contract_version
+        )
+        
+        store_results(missing_candidates, votes)
+        results.update(votes)
+    
+    return results
+
+# Async version of snapshot_results, which reads the missing counts concurrently
+async def async_snapshot_results(ballot, candidates):
+    results, missing_candidates = get_stored_results(candidates)
+    if missing_candidates and ballot.contract_address is not None:
+        from .chain import async_read_vote_counts
+        votes = await async_read_vote_counts(
+            ballot.contract_address,
+            [candidate.pk_inside_ballot for candidate in missing_candidates],
+            int(datetime.timestamp(timezone.now())),
+            ballot.contract_version
+        )
+        
+        await sync_to_async(store_results)(missing_candidates, votes)
+        results.update(votes)
+    
+    return results
+
+# Returns a dict with the votes of each candidate (by pk_inside_ballot). For finished ballots results are only read
+# from the chain the first time, after that they are served from the database. For active ballots (and ballots whose
+# results aren't final yet, as votes sent before the end may still be mined) the counts stored by the poll_tallies
+# command are returned. Candidates should come with their candidate_result and live_tally already
+# loaded (select_related), so no extra query is made
+def get_ballot_results(ballot, candidates=None):
+    now = timezone.now()
+    if ballot.start_datetime > now:
+        return {}
+    
+    if candidates is None:
+        candidates = list(Candidate.objects.filter(ballot_parent=ballot).select_related('candidate_result', 'live_tally'))
+    
+    if ballot.get_final_datetime() >= now:
+        return get_live_tallies(candidates)
+    
+    return snapshot_results(ballot, candidates)
+
+# Async version of get_ballot_results, for candidates already loaded with their candidate_result and live_tally
+async def async_get_ballot_results(ballot, candidates):
+    now = timezone.now()
+    if ballot.start_datetime > now:
+        return {}
+    if ballot.get_final_datetime() >= now:
+        return get_live_tallies(candidates)
+    
+    return await async_snapshot_results(ballot, candidates)
@@ -1,16 +1,12 @@
-from web3 import Web3, HTTPProvider
-from web3.middleware import geth_poa_middleware
-
-from .contract import get_abi, get_bytecode
+from .results import get_ballot_results
+from .tallies import get_tallies_block_number
 
 from datetime import datetime
+from django.db import transaction
 from django.utils import timezone
 from rest_framework import serializers
 
-from .models import BallotBox, Candidate
-
-import os
-from dotenv import load_dotenv, find_dotenv
+from .models import BallotBox, Candidate, DeploymentJob
 
 class BallotBoxCreateOrUpdateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -30,102 +26,100 @@ class BallotBoxCreateOrUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('End datetime must be after start datetime')
         
         return value
-    
+
 class BallotBoxListSerializer(serializers.ModelSerializer):
     class Meta:
         model = BallotBox
         fields = ['id', 'name', 'start_datetime', 'end_datetime']
-    
+
 class BallotBoxRetrieveSerializer(serializers.ModelSerializer):
     candidates = serializers.SerializerMethodField()
+    counts_block_number = serializers.SerializerMethodField()
+    deployed = serializers.SerializerMethodField()
     class Meta:
         model = BallotBox
-        fields = ['id', 'name', 'start_datetime', 'end_datetime', 'candidates']
+        fields = ['id', 'name', 'start_datetime', 'end_datetime', 'finalized', 'deployed', 'candidates', 'counts_block_number']
     
-    # As candidates aren't part of the model, we have to tell Django how to retrieve them   
+    # As candidates aren't part of the model, we have to tell Django how to retrieve them.
+    # The view prefetches them (with their stored results), so this doesn't query the database again.
+    # Async views read the results beforehand and pass them as context
     def get_candidates(self, instance):
-        candidateQuery = Candidate.objects.filter(ballot_parent = instance)
-        return CandidateRetrieveForBallotSerializer(candidateQuery, many = True).data
+        candidates = list(instance.candidate_set.all())
+        results = self.context['results'] if 'results' in self.context else get_ballot_results(instance, candidates)
+        return CandidateRetrieveForBallotSerializer(candidates, many = True, context = {'results': results}).data
+    
+    # Ballots without a deployed contract can't be voted, so their candidates have no results
+    def get_deployed(self, instance):
+        return instance.contract_address is not None
     
+    # Until the results are final, they are the counts read by the poller as of this block
+    def get_counts_block_number(self, instance):
+        if instance.start_datetime <= timezone.now() <= instance.get_final_datetime():
+            return get_tallies_block_number(instance.candidate_set.all())
         
+        return None
+
+
 class BallotBoxContractAddressSerializer(serializers.ModelSerializer):
     class Meta:
         model = BallotBox
         fields = ['contract_address']
-        
+
 class CandidateCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Candidate
         fields = ['name', 'img_path', 'description', 'website', 'motto']
-        
+    
     def validate(self, attrs):
-        attrs['ballot_parent'] = BallotBox.objects.get(id=self.context['ballot_parent_id'])
-        attrs['pk_inside_ballot'] = int(self.context['last_candidate_id']) + 1
+        # Bulk imports pass the ballot itself, so it isn't read again for every candidate
+        if 'ballot_parent' in self.context:
+            attrs['ballot_parent'] = self.context['ballot_parent']
+        else:
+            attrs['ballot_parent'] = BallotBox.objects.get(id=self.context['ballot_parent_id'])
         
         return super().validate(attrs)
     
+    # The position inside the ballot is reserved in the same transaction as the insert, so a failed insert doesn't leave a gap
     def create(self, validated_data):
-        self.deploy_contract(validated_data)
-        return super().create(validated_data)
-    
-    def deploy_contract(self, validated_data):
-        load_dotenv(find_dotenv())
-        
-        w3 = Web3(HTTPProvider('https://polygon-mumbai.infura.io/v3/' + os.environ['INFURA_API_KEY']))
-        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-        
-        admin_account = w3.eth.account.privateKeyToAccount(os.environ['ACCOUNT_KEY'])
-        contract = w3.eth.contract(abi=get_abi(), bytecode=get_bytecode())
-        
-        candidateNames = []
-        candidatesPositionInsideBallot = []
-        for candidate in Candidate.objects.all().filter(ballot_parent_id=validated_data['ballot_parent'].id):
-            candidateNames.append(Web3.toHex(text=candidate.name))
-            candidatesPositionInsideBallot.append(candidate.pk_inside_ballot)
-        candidateNames.append(Web3.toHex(text=validated_data['name']))
-        candidatesPositionInsideBallot.append(validated_data['pk_inside_ballot'])
-        
-        txn = \
-            contract.constructor(
-                candidateNames,
-                candidatesPositionInsideBallot,
-                int(datetime.timestamp(validated_data['ballot_parent'].end_datetime)),
-                int(datetime.timestamp(validated_data['ballot_parent'].start_datetime))
-            ).buildTransaction(
-                {
-                    'from': admin_account.address,
-                    'nonce': w3.eth.getTransactionCount(admin_account.address),
-                }
-            ); 
-        signed_txn = admin_account.signTransaction(txn)
-            
-        txn_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        txn_receipt = w3.eth.wait_for_transaction_receipt(txn_hash)
-        
-        validated_data['ballot_parent'].contract_address = txn_receipt['contractAddress']
-        validated_data['ballot_parent'].save()
-        
+        with transaction.atomic():
+            validated_data['pk_inside_ballot'] = validated_data['ballot_parent'].allocate_pks_inside_ballot()
+            return super().create(validated_data)
+
+# On bulk imports images are optional, as JSON, CSV and NDJSON bodies can't carry files
+class CandidateBulkCreateSerializer(CandidateCreateSerializer):
+    class Meta(CandidateCreateSerializer.Meta):
+        extra_kwargs = {'img_path': {'required': False}}
+
 class CandidateListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Candidate
         fields = ['pk_inside_ballot', 'name', 'img_path', 'description', 'website', 'motto']
-    
+
 class CandidateRetrieveForBallotSerializer(serializers.ModelSerializer):
     result = serializers.SerializerMethodField()
     class Meta:
         model = Candidate
         fields = ['pk_inside_ballot', 'name', 'result']
-        
+    
+    # Results are computed for the whole ballot by the parent serializer, so here we only look them up
     def get_result(self, candidate):
-        if(candidate.ballot_parent.end_datetime < timezone.now()):
-            w3 = Web3(HTTPProvider('https://polygon-mumbai.infura.io/v3/' + os.environ['INFURA_API_KEY']))
-            w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-            
-            contract = w3.eth.contract(abi=get_abi(), address=candidate.ballot_parent.contract_address)
-            
-            result = contract.functions.getProposalVoteCount(candidate.pk_inside_ballot, int(datetime.timestamp(timezone.now()))).call()
-            
-            return result
+        if 'results' not in self.context:
+            self.context['results'] = get_ballot_results(candidate.ballot_parent)
+        
+        return self.context['results'].get(candidate.pk_inside_ballot)
 
-        return None
-    
\ No newline at end of file
+
+class DeploymentJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeploymentJob
+        fields = ['id', 'ballot', 'status', 'txn_hash', 'contract_address', 'contract_version', 'error', 'created_datetime', 'updated_datetime']
+    
+    # Errors are only shown to staff
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        
+        request = self.context.get('request')
+        if request is None or not request.user.is_staff:
+            data['error'] = None
+        
+        return data
@@ -0,0 +1,180 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+import asyncio
+import json
+import logging
+import re
+
+from .conditional import FINISHED, get_ballot_phase
+from .database import close_unusable_connections
+from .models import BallotBox, Candidate
+from .results import get_ballot_results
+from .tallies import get_tallies_block_number
+
+STREAM_PATH = re.compile(r'^/api/ballot/(?P<pk>\d+)/stream$')
+COUNTS_EVENT = 'counts'
+FINISHED_EVENT = 'finished'
+
+logger = logging.getLogger(__name__)
+
+# Channels of the ballots with subscribers in this process, by ballot id
+_channels = {}
+
+
+# Returns whether the ballot has finished, the counts of its candidates (by pk_inside_ballot) and the block they were read at
+def read_ballot_counts(ballot_id):
+    ballot = BallotBox.objects.get(id=ballot_id)
+    candidates = list(Candidate.objects.filter(ballot_parent=ballot).select_related('candidate_result', 'live_tally'))
+    finished = get_ballot_phase(ballot) == FINISHED
+    
+    return finished, get_ballot_results(ballot, candidates), None if finished else get_tallies_block_number(candidates)
+
+# Channels read outside of any request, so the connections of the thread are checked before the read and closed after
+# it when they are too old, as they would be at the start and end of a request. Reads run on the shared thread pool
+# instead of a single thread, so a slow read doesn't hold up the channels of other ballots
+def read_ballot_counts_in_thread(ballot_id):
+    close_unusable_connections()
+    try:
+        return read_ballot_counts(ballot_id)
+    finally:
+        close_old_connections()
+
+def format_event(event, data):
+    return ('event: ' + event + '\ndata: ' + json.dumps(data) + '\n\n').encode()
+
+# Every subscriber of a ballot gets its events from a single channel, which reads the counts once every interval
+# (whatever the number of subscribers) and sends them only what changed
+class BallotChannel:
+    def __init__(self, ballot_id):
+        self.ballot_id = ballot_id
+        self.subscribers = set()
+        self.counts = None
+        self.block_number = None
+        self.task = None
+    
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=settings.RESULTS_STREAM_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        
+        # New subscribers start with the whole counts, later ones are sent as soon as the channel has read them
+        if self.counts is not None:
+            queue.put_nowait(self.get_snapshot())
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        
+        return queue
+    
+    # The counts stop being read when the last subscriber leaves
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.close()
+    
+    def close(self):
+        if _channels.get(self.ballot_id) is self:
+            del _channels[self.ballot_id]
+    
+    def get_snapshot(self):
+        return (COUNTS_EVENT, {'counts': self.counts, 'block_number': self.block_number})
+    
+    async def run(self):
+        while True:
+            try:
+                finished, counts, block_number = await sync_to_async(read_ballot_counts_in_thread, thread_sensitive=False)(self.ballot_id)
+            except Exception:
+                logger.exception('Could not read counts of ballot %s', self.ballot_id)
+            else:
+                first_read = self.counts is None
+                changes = {position: votes for position, votes in counts.items() if first_read or self.counts.get(position) != votes}
+                self.counts = counts
+                self.block_number = block_number
+                
+                if changes or first_read:
+                    self.publish((COUNTS_EVENT, {'counts': changes, 'block_number': block_number}))
+                if finished:
+                    self.publish((FINISHED_EVENT, {'counts': counts}))
+                    self.close()
+                    return
+            
+            await asyncio.sleep(settings.RESULTS_STREAM_INTERVAL)
+    
+    def publish(self, event):
+        for queue in self.subscribers:
+            # A subscriber too slow to get every change has its pending events replaced with the whole counts
+            if queue.full():
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.get_snapshot())
+                if event[0] == COUNTS_EVENT:
+                    continue
+            
+            queue.put_nowait(event)
+
+def get_channel(ballot_id):
+    if ballot_id not in _channels:
+        _channels[ballot_id] = BallotChannel(ballot_id)
+    
+    return _channels[ballot_id]
+
+async def send_events(queue, send):
+    while True:
+        try:
+            event, data = await asyncio.wait_for(queue.get(), settings.RESULTS_STREAM_KEEPALIVE)
+        except asyncio.TimeoutError:
+            await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+            continue
+        
+        await send({'type': 'http.response.body', 'body': format_event(event, data), 'more_body': True})
+        if event == FINISHED_EVENT:
+            return
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+# Streams the counts of a ballot as Server-Sent Events: a "counts" event with the whole counts first, then one with
+# the counts that changed (and the block they were read at) each time they change, and a "finished" event with the
+# final counts once the ballot finishes, which ends the stream
+async def stream_results(ballot_id, receive, send):
+    if not await sync_to_async(BallotBox.objects.filter(id=ballot_id).exists)():
+        await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': b'{"detail":"Not found."}'})
+        return
+    
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+    })
+    
+    channel = get_channel(ballot_id)
+    queue = channel.subscribe()
+    sender = asyncio.ensure_future(send_events(queue, send))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait([sender, disconnect], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sender.cancel()
+        disconnect.cancel()
+        channel.unsubscribe(queue)
+    
+    if sender.done() and not sender.cancelled():
+        sender.result()
+        await send({'type': 'http.response.body', 'body': b''})
+
+# Serves the results stream of the ballots, passing every other request to the Django application.
+# Django 4.0 can't stream from async code, so the stream is served as a plain ASGI application
+class ResultsStreamRouter:
+    def __init__(self, application):
+        self.application = application
+    
+    async def __call__(self, scope, receive, send):
+        match = STREAM_PATH.match(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if match is None:
+            return await self.application(scope, receive, send)
+        
+        await stream_results(int(match['pk']), receive, send)
@@ -0,0 +1,55 @@
+from datetime import datetime
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BallotBox, Candidate, LiveTally
+
+
+# Reads the current counts of every candidate of an active ballot and stores them.
+# Returns whether any count changed, in which case the ballot is marked as changed so cached responses are dropped
+def refresh_tallies(ballot):
+    candidates = list(Candidate.objects.filter(ballot_parent=ballot).select_related('live_tally'))
+    if not candidates:
+        return False
+    
+    from .chain import read_vote_counts_at_latest_block
+    
+    # The contract refuses to count with a timestamp before the end of the ballot, and the timestamp is only used for
+    # that check, so the current counts are read with the end timestamp
+    block_number, votes = read_vote_counts_at_latest_block(
+        ballot.contract_address,
+        [candidate.pk_inside_ballot for candidate in candidates],
+        int(datetime.timestamp(ballot.end_datetime)) + 1,
+        ballot.contract_version
+    )
+    
+    new_tallies = []
+    updated_tallies = []
+    changed = False
+    for candidate in candidates:
+        if hasattr(candidate, 'live_tally'):
+            changed = changed or candidate.live_tally.votes != votes[candidate.pk_inside_ballot]
+            candidate.live_tally.votes = votes[candidate.pk_inside_ballot]
+            candidate.live_tally.block_number = block_number
+            candidate.live_tally.updated_datetime = timezone.now()
+            updated_tallies.append(candidate.live_tally)
+        else:
+            changed = True
+            new_tallies.append(LiveTally(candidate=candidate, votes=votes[candidate.pk_inside_ballot], block_number=block_number))
+    
+    with transaction.atomic():
+        LiveTally.objects.bulk_create(new_tallies, ignore_conflicts=True)
+        LiveTally.objects.bulk_update(updated_tallies, ['votes', 'block_number', 'updated_datetime'])
+        if changed:
+            BallotBox.mark_changed(ballot.id)
+    
+    return changed
+
+def get_live_tallies(candidates):
+    return {candidate.pk_inside_ballot: candidate.live_tally.votes for candidate in candidates if hasattr(candidate, 'live_tally')}
+
+# Block of the oldest stored count, so the whole ballot can be said to be counted as of that block
+def get_tallies_block_number(candidates):
+    block_numbers = [candidate.live_tally.block_number for candidate in candidates if hasattr(candidate, 'live_tally')]
+    
+    return min(block_numbers) if block_numbers else None
@@ -1,21 +1,142 @@
 from datetime import timedelta
 from django.utils import timezone
 
+import asyncio
+import importlib
+import json
+import os
+import requests
+import subprocess
+import sys
+import threading
+from unittest import mock, skipUnless
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from eth_account import Account
+from web3 import Web3
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
 from django.contrib.auth.models import User
 from django.core.files.images import ImageFile
-from rest_framework.test import APITestCase
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connections, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 from rest_framework import status
 
-from .models import BallotBox, Candidate
+from .backends import LocalNodeBackend
+from .chain import PooledHTTPProvider, async_call, batch_call, create_async_web3, create_endpoint_pool, create_session, create_web3, get_admin_account, get_transaction_receipts, get_web3
+from .contract import ContractArtifact, ContractArtifactError, get_abi, get_artifact, get_bytecode
+from .database import close_unusable_connections
+from .deployment import claim_next_job, enqueue_deployment, fail_deployment_job, finalize_ballot, submit_deployment_job
+from .endpoints import EndpointPool
+from .models import AccountNonce, BallotBox, BallotListVersion, Candidate, CandidateResult, DeploymentJob, LiveTally
+from .nonces import UnconfirmedTransaction, send_transaction
+from .pipeline import TransactionPipeline
+from .replicas import ReplicaRouter, read_from
+from .streams import ResultsStreamRouter, read_ballot_counts
+from .tallies import refresh_tallies
 
 # Create your tests here.
 
+# Minimal JSON-RPC node that answers every eth_call with the first argument of the call plus 5, has a receipt for every
+# transaction but the one with hash 0, and counts the HTTP requests received
+class StubRPCHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.http_requests += 1
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        calls = body if isinstance(body, list) else [body]
+        
+        responses = []
+        for call in calls:
+            if call['method'] == 'eth_getTransactionReceipt':
+                receipt = None if int(call['params'][0], 16) == 0 else {'blockNumber': '0x1', 'status': '0x1', 'contractAddress': None}
+                responses.append({'jsonrpc': '2.0', 'id': call['id'], 'result': receipt})
+                continue
+            
+            first_argument = int(call['params'][0]['data'][10:74], 16)
+            responses.append({'jsonrpc': '2.0', 'id': call['id'], 'result': '0x' + (first_argument + 5).to_bytes(32, 'big').hex()})
+        
+        content = json.dumps(responses if isinstance(body, list) else responses[0]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def log_message(self, format, *args):
+        pass
+
+# Node that is always rate limited
+class RateLimitedRPCHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.http_requests += 1
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(429)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_rpc_server(handler=StubRPCHandler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.http_requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    return server, 'http://127.0.0.1:' + str(server.server_address[1])
+
 class BallotListTest(APITestCase):
     def test_get_ballot_list(self):
         response = self.client.get('/api/ballot')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
     
+    def test_get_ballot_list_pages(self):
+        for ballot_number in range(5):
+            BallotBox.objects.create(
+                name = 'Test ' + str(ballot_number),
+                start_datetime = timezone.now() + timedelta(hours=ballot_number + 1),
+                end_datetime = timezone.now() + timedelta(hours=10),
+            )
+        
+        first_page = self.client.get('/api/ballot', {'page_size': 3})
+        second_page = self.client.get(first_page.data['next'])
+        
+        self.assertEqual([ballot['name'] for ballot in first_page.data['results']], ['Test 0', 'Test 1', 'Test 2'])
+        self.assertEqual([ballot['name'] for ballot in second_page.data['results']], ['Test 3', 'Test 4'])
+        self.assertTrue(second_page.data['next'] is None)
+    
+    def test_get_ballot_list_by_status(self):
+        BallotBox.objects.create(
+            name = 'Upcoming',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        BallotBox.objects.create(
+            name = 'Active',
+            start_datetime = timezone.now() - timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        BallotBox.objects.create(
+            name = 'Finished',
+            start_datetime = timezone.now() - timedelta(hours=10),
+            end_datetime = timezone.now() - timedelta(hours=1),
+        )
+        
+        for ballot_status, name in [('upcoming', 'Upcoming'), ('active', 'Active'), ('finished', 'Finished')]:
+            response = self.client.get('/api/ballot', {'status': ballot_status})
+            
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([ballot['name'] for ballot in response.data['results']], [name])
+        
+        response = self.client.get('/api/ballot', {'status': 'unknown'})
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
 class BallotViewTest(APITestCase):
     def test_get_inexistent_ballot(self):
         response = self.client.get('/api/ballot/1')
@@ -85,10 +206,203 @@ class BallotViewTest(APITestCase):
         ballot.save()
         candidate.save()
         
+        # The ballot was never finalized, so there is no contract to read the results from
+        for url in ['/api/ballot/' + str(ballot.id), '/api/ballot/' + str(ballot.id) + '?format=api']:
+            response = self.client.get(url)
+            
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(response.data['deployed'])
+            self.assertTrue(response.data['candidates'][0]["result"] is None)
+    
+    def test_get_finished_ballot_with_stored_results(self):
+        start_datetime = timezone.now() - timedelta(hours=10)
+        end_datetime = timezone.now() - timedelta(hours=1)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        CandidateResult.objects.create(candidate = candidate, votes = 7)
+        
         response = self.client.get('/api/ballot/' + str(ballot.id))
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(response.data['candidates'][0]["result"] is not None)
+        self.assertEqual(response.data['candidates'][0]["result"], 7)
+    
+    def test_get_finished_ballot_reads_missing_results(self):
+        start_datetime = timezone.now() - timedelta(hours=10)
+        end_datetime = timezone.now() - timedelta(hours=1)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            contract_address = '0x0000000000000000000000000000000000000001',
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        
+        # The async view reads the results that aren't stored yet, and stores them
+        with mock.patch('api.chain.async_read_vote_counts', mock.AsyncMock(return_value={0: 9})) as read_counts:
+            response = self.client.get('/api/ballot/' + str(ballot.id))
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['candidates'][0]["result"], 9)
+        self.assertEqual(read_counts.call_count, 1)
+        self.assertEqual(CandidateResult.objects.get(candidate = candidate).votes, 9)
+    
+    def test_get_ballot_query_count(self):
+        start_datetime = timezone.now() - timedelta(hours=10)
+        end_datetime = timezone.now() - timedelta(hours=1)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        ballot.save()
+        
+        for candidate_number in range(20):
+            candidate = Candidate(
+                name = 'Test Candidate ' + str(candidate_number),
+                img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+                description = 'Test description for Test Candidate',
+                ballot_parent = ballot,
+                pk_inside_ballot = candidate_number
+            )
+            candidate.save()
+            CandidateResult.objects.create(candidate = candidate, votes = candidate_number)
+        
+        # One query for the ballot and one for its candidates with their results
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/ballot/' + str(ballot.id))
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([candidate["result"] for candidate in response.data['candidates']], list(range(20)))
+    
+    def test_get_active_ballot_with_live_tallies(self):
+        start_datetime = timezone.now() - timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            contract_address = '0x0000000000000000000000000000000000000001',
+        )
+        
+        ballot.save()
+        
+        for candidate_number in range(3):
+            candidate = Candidate(
+                name = 'Test Candidate ' + str(candidate_number),
+                img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+                description = 'Test description for Test Candidate',
+                ballot_parent = ballot,
+                pk_inside_ballot = candidate_number
+            )
+            candidate.save()
+            LiveTally.objects.create(candidate = candidate, votes = candidate_number * 2, block_number = 100 + candidate_number)
+        
+        # Counts come from the stored tallies, so the chain is never called
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/ballot/' + str(ballot.id))
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([candidate["result"] for candidate in response.data['candidates']], [0, 2, 4])
+        self.assertEqual(response.data['counts_block_number'], 100)
+    
+    def test_get_ended_ballot_before_results_are_final(self):
+        start_datetime = timezone.now() - timedelta(hours=1)
+        end_datetime = timezone.now() - timedelta(seconds=30)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            contract_address = '0x0000000000000000000000000000000000000001',
+        )
+        
+        ballot.save()
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        candidate.save()
+        LiveTally.objects.create(candidate = candidate, votes = 3, block_number = 100)
+        
+        # Votes sent before the end may still be mined, so the counts are served live and nothing is stored yet
+        with override_settings(RESULTS_FINALITY_SECONDS=60), mock.patch('api.chain.async_read_vote_counts') as read_vote_counts:
+            response = self.client.get('/api/ballot/' + str(ballot.id))
+        
+        read_vote_counts.assert_not_called()
+        self.assertEqual(response.data['candidates'][0]['result'], 3)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertFalse(CandidateResult.objects.exists())
+        
+        with override_settings(RESULTS_FINALITY_SECONDS=10), mock.patch('api.chain.async_read_vote_counts', return_value={0: 4}):
+            response = self.client.get('/api/ballot/' + str(ballot.id))
+        
+        self.assertEqual(response.data['candidates'][0]['result'], 4)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(CandidateResult.objects.get(candidate = candidate).votes, 4)
+    
+    def test_refresh_tallies(self):
+        start_datetime = timezone.now() - timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            contract_address = '0x0000000000000000000000000000000000000001',
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        
+        with mock.patch('api.chain.read_vote_counts_at_latest_block', return_value=(100, {0: 3})):
+            self.assertTrue(refresh_tallies(ballot))
+        with mock.patch('api.chain.read_vote_counts_at_latest_block', return_value=(101, {0: 3})):
+            self.assertFalse(refresh_tallies(ballot))
+        
+        tally = LiveTally.objects.get(candidate = candidate)
+        self.assertEqual(tally.votes, 3)
+        self.assertEqual(tally.block_number, 101)
     
 class BallotCreateTest(APITestCase):
     def test_create_ballot_with_early_initTimestamp(self):
@@ -281,6 +595,44 @@ class BallotUpdateTest(APITestCase):
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+# The async views serve the same paths as the viewsets, so writes there must behave as they do on the viewsets
+class CSRFTest(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create(username='admin', is_staff=True)
+        self.csrf_client = APIClient(enforce_csrf_checks=True)
+        
+        self.ballot = BallotBox(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        self.ballot.save()
+    
+    def test_token_writes_skip_csrf(self):
+        self.csrf_client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.admin_user).key)
+        
+        response = self.csrf_client.patch('/api/ballot/' + str(self.ballot.id), {'name': 'Test 2'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        response = self.csrf_client.post('/api/candidates/' + str(self.ballot.id), {
+            'name': 'Test Candidate',
+            'img_path': ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            'description': 'Test description for Test Candidate'
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        response = self.csrf_client.delete('/api/ballot/' + str(self.ballot.id))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    
+    def test_session_writes_need_csrf_token(self):
+        self.admin_user.set_password('admin')
+        self.admin_user.save()
+        self.csrf_client.login(username='admin', password='admin')
+        
+        response = self.csrf_client.patch('/api/ballot/' + str(self.ballot.id), {'name': 'Test 2'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 class BallotDeleteTest(APITestCase):
     def test_delete_inexistent_ballot(self):
         admin_user = User.objects.create(username='admin', is_staff=True)
@@ -406,6 +758,57 @@ class CandidateListTest(APITestCase):
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
     
+    def test_get_candidate_ballot_query_count(self):
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        
+        # One query for the ballot version (used for the ETag) and one for the candidates
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/candidates/' + str(ballot.id))
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+class MediaTest(APITestCase):
+    # Tests run without debug mode, as production does
+    def test_candidate_image_is_served(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        candidate.save()
+        
+        response = self.client.get(candidate.img_path.url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), open('api/test/data/empty_user.png', 'rb').read())
+
 class CandidateCreateTest(APITestCase):
     def test_create_candidate_for_inexistent_ballot(self):
         admin_user = User.objects.create(username='admin', is_staff=True)
@@ -524,65 +927,569 @@ class CandidateCreateTest(APITestCase):
         
         self.assertEqual(response_first_candidate.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response_second_candidate.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response_first_candidate.data['pk_inside_ballot'], 0)
+        self.assertEqual(response_second_candidate.data['pk_inside_ballot'], 1)
+
+class ConditionalGetTest(APITestCase):
+    def test_get_unchanged_ballot(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        response = self.client.get('/api/ballot/' + str(ballot.id))
+        
+        with self.assertNumQueries(1):
+            not_modified_response = self.client.get('/api/ballot/' + str(ballot.id), HTTP_IF_NONE_MATCH=response['ETag'])
+        
+        self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('no-cache', response['Cache-Control'])
     
-class CandidateDeleteTest(APITestCase):
-    def test_delete_inexistent_or_existent_candidate_for_inexistent_ballot(self):
+    def test_get_changed_ballot(self):
         admin_user = User.objects.create(username='admin', is_staff=True)
-        self.client.force_authenticate(user=admin_user)
         
-        start_datetime = timezone.now() + timedelta(hours=1)
-        end_datetime = timezone.now() + timedelta(hours=10)
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
         
-        ballot = BallotBox(
+        ballot_response = self.client.get('/api/ballot/' + str(ballot.id))
+        candidates_response = self.client.get('/api/candidates/' + str(ballot.id))
+        list_response = self.client.get('/api/ballot')
+        
+        self.client.force_authenticate(user=admin_user)
+        self.client.post('/api/candidates/' + str(ballot.id), {
+            'name': 'Test Candidate',
+            'img_path' : ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            'description' : 'Test description for Test Candidate',
+        })
+        self.client.patch('/api/ballot/' + str(ballot.id), {
+            'name': 'Test 2'
+        })
+        
+        self.assertEqual(self.client.get('/api/ballot/' + str(ballot.id), HTTP_IF_NONE_MATCH=ballot_response['ETag']).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/candidates/' + str(ballot.id), HTTP_IF_NONE_MATCH=candidates_response['ETag']).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/ballot', HTTP_IF_NONE_MATCH=list_response['ETag']).status_code, status.HTTP_200_OK)
+    
+    def test_get_unchanged_ballot_list_and_candidates(self):
+        ballot = BallotBox.objects.create(
             name = 'Test',
-            start_datetime = start_datetime,
-            end_datetime = end_datetime,
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
         )
         
-        candidate = Candidate(
-            name = 'Test Candidate',
-            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
-            description = 'Test description for Test Candidate',
-            ballot_parent = ballot,
-            pk_inside_ballot = 0
+        list_response = self.client.get('/api/ballot')
+        candidates_response = self.client.get('/api/candidates/' + str(ballot.id))
+        
+        self.assertEqual(self.client.get('/api/ballot', HTTP_IF_NONE_MATCH=list_response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get('/api/candidates/' + str(ballot.id), HTTP_IF_MODIFIED_SINCE=candidates_response['Last-Modified']).status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_get_finished_ballot_is_immutable(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() - timedelta(hours=10),
+            end_datetime = timezone.now() - timedelta(hours=1),
         )
         
-        ballot.save()
-        candidate.save()
-
-        response = self.client.delete('/api/candidates/' + str(ballot.id + 1) + '/1')
+        response = self.client.get('/api/ballot/' + str(ballot.id))
         
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn('immutable', response['Cache-Control'])
+    
+    def test_get_ballot_modified_since_before_end(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() - timedelta(hours=3),
+            end_datetime = timezone.now() + timedelta(hours=1),
+        )
+        BallotBox.objects.filter(id=ballot.id).update(updated_datetime=timezone.now() - timedelta(hours=2))
         
-    def test_delete_inexistent_candidate_for_ballot(self):
-        admin_user = User.objects.create(username='admin', is_staff=True)
-        self.client.force_authenticate(user=admin_user)
+        response = self.client.get('/api/ballot/' + str(ballot.id))
         
-        start_datetime = timezone.now() + timedelta(hours=1)
-        end_datetime = timezone.now() + timedelta(hours=10)
+        # Finishing changes the results without saving the ballot
+        BallotBox.objects.filter(id=ballot.id).update(end_datetime=timezone.now() - timedelta(hours=1))
         
-        ballot = BallotBox(
+        self.assertEqual(self.client.get('/api/ballot/' + str(ballot.id), HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/candidates/' + str(ballot.id), HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, status.HTTP_200_OK)
+    
+    def test_saving_stale_ballot_changes_etag(self):
+        ballot = BallotBox.objects.create(
             name = 'Test',
-            start_datetime = start_datetime,
-            end_datetime = end_datetime,
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
         )
         
-        candidate = Candidate(
-            name = 'Test Candidate',
-            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
-            description = 'Test description for Test Candidate',
-            ballot_parent = ballot,
-            pk_inside_ballot = 0
-        )
+        # The instance is read before another change of the ballot (adding a candidate, for example)
+        stale_ballot = BallotBox.objects.get(id=ballot.id)
+        BallotBox.mark_changed(ballot.id)
+        changed_response = self.client.get('/api/ballot/' + str(ballot.id))
         
-        ballot.save()
-        candidate.save()
-
-        response = self.client.delete('/api/candidates/' + str(ballot.id) + '/1')
+        stale_ballot.name = 'Test 2'
+        stale_ballot.save()
+        response = self.client.get('/api/ballot/' + str(ballot.id), HTTP_IF_NONE_MATCH=changed_response['ETag'])
         
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-       
-    def test_delete_candidate_for_started_ballot(self):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Test 2')
+        self.assertEqual(stale_ballot.version, 3)
+    
+    def test_get_unchanged_ballot_list(self):
+        for ballot_number in range(20):
+            BallotBox.objects.create(
+                name = 'Test ' + str(ballot_number),
+                start_datetime = timezone.now() + timedelta(hours=1),
+                end_datetime = timezone.now() + timedelta(hours=10),
+            )
+        
+        list_response = self.client.get('/api/ballot')
+        
+        # The ETag is read from the list version, however many ballots there are
+        with self.assertNumQueries(1):
+            not_modified_response = self.client.get('/api/ballot', HTTP_IF_NONE_MATCH=list_response['ETag'])
+        
+        self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(BallotListVersion.get().version, 20)
+    
+    def test_candidate_changes_keep_ballot_list(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        list_response = self.client.get('/api/ballot')
+        
+        self.client.force_authenticate(user=admin_user)
+        self.client.post('/api/candidates/' + str(ballot.id), {
+            'name': 'Test Candidate',
+            'img_path' : ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            'description' : 'Test description for Test Candidate',
+        })
+        BallotBox.mark_changed(ballot.id)
+        ballot.refresh_from_db()
+        ballot.finalized = True
+        ballot.save()
+        
+        self.assertEqual(self.client.get('/api/ballot', HTTP_IF_NONE_MATCH=list_response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(BallotListVersion.get().version, 1)
+    
+    def test_get_ballot_list_by_status_after_start(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        list_response = self.client.get('/api/ballot?status=active')
+        
+        # Starting changes which ballots are active without changing any of them
+        BallotBox.objects.filter(id=ballot.id).update(start_datetime=timezone.now() - timedelta(minutes=1))
+        
+        self.assertEqual(self.client.get('/api/ballot?status=active', HTTP_IF_NONE_MATCH=list_response['ETag']).status_code, status.HTTP_200_OK)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'response-cache-test'}})
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def test_get_cached_ballot(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        self.client.get('/api/ballot/' + str(ballot.id))
+        self.client.get('/api/candidates/' + str(ballot.id))
+        self.client.get('/api/ballot')
+        
+        with self.assertNumQueries(0):
+            ballot_response = self.client.get('/api/ballot/' + str(ballot.id))
+            candidates_response = self.client.get('/api/candidates/' + str(ballot.id))
+            list_response = self.client.get('/api/ballot')
+        
+        self.assertEqual(ballot_response.data['name'], 'Test')
+        self.assertEqual(candidates_response.data, [])
+        self.assertEqual(len(list_response.data['results']), 1)
+    
+    def test_get_ballot_after_change(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        self.client.get('/api/ballot/' + str(ballot.id))
+        self.client.get('/api/candidates/' + str(ballot.id))
+        self.client.get('/api/ballot')
+        
+        self.client.force_authenticate(user=admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/candidates/' + str(ballot.id), {
+                'name': 'Test Candidate',
+                'img_path' : ImageFile(open('api/test/data/empty_user.png', 'rb')),
+                'description' : 'Test description for Test Candidate',
+            })
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/ballot/' + str(ballot.id), {
+                'name': 'Test 2'
+            })
+        
+        self.assertEqual(self.client.get('/api/ballot/' + str(ballot.id)).data['candidates'][0]['name'], 'Test Candidate')
+        self.assertEqual(len(self.client.get('/api/candidates/' + str(ballot.id)).data), 1)
+        self.assertEqual(self.client.get('/api/ballot').data['results'][0]['name'], 'Test 2')
+
+class CandidateSequenceTest(APITestCase):
+    def test_allocate_pks_inside_ballot(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        self.assertEqual(ballot.allocate_pks_inside_ballot(), 0)
+        self.assertEqual(ballot.allocate_pks_inside_ballot(3), 1)
+        self.assertEqual(BallotBox.objects.get(id=ballot.id).allocate_pks_inside_ballot(), 4)
+
+class DeploymentJobTest(APITestCase):
+    def test_finalize_ballot_queues_single_deployment(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        ballot.save()
+        
+        for candidate_number in range(3):
+            self.client.post('/api/candidates/' + str(ballot.id), {
+                'name': 'Test Candidate ' + str(candidate_number),
+                'img_path' : ImageFile(open('api/test/data/empty_user.png', 'rb')),
+                'description' : 'Test description for Test Candidate',
+            })
+        
+        self.assertEqual(DeploymentJob.objects.filter(ballot = ballot).count(), 0)
+        
+        response = self.client.post('/api/ballot/' + str(ballot.id) + '/finalize')
+        
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], DeploymentJob.QUEUED)
+        self.assertEqual(DeploymentJob.objects.filter(ballot = ballot).count(), 1)
+        
+        response = self.client.get(response['Location'])
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], DeploymentJob.QUEUED)
+        self.assertTrue(response.data['txn_hash'] is None)
+    
+    def test_finalize_ballot_twice(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        
+        response_first_finalize = self.client.post('/api/ballot/' + str(ballot.id) + '/finalize')
+        response_second_finalize = self.client.post('/api/ballot/' + str(ballot.id) + '/finalize')
+        
+        self.assertEqual(response_first_finalize.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response_second_finalize.status_code, status.HTTP_409_CONFLICT)
+    
+    def test_finalize_empty_ballot(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        ballot.save()
+        
+        response = self.client.post('/api/ballot/' + str(ballot.id) + '/finalize')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_create_candidate_for_finalized_ballot(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            finalized = True
+        )
+        
+        ballot.save()
+        
+        response = self.client.post('/api/candidates/' + str(ballot.id), {
+            'name': 'Test Candidate',
+            'img_path' : ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            'description' : 'Test description for Test Candidate',
+        })
+        
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+    
+    def test_deployed_ballots_are_finalized_by_migration(self):
+        migration = importlib.import_module('api.migrations.0018_backfill_ballotbox_finalized')
+        
+        deployed_ballot = BallotBox.objects.create(
+            name = 'Deployed',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+            contract_address = '0x' + '1' * 40,
+        )
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        migration.finalize_deployed_ballots(apps, None)
+        
+        self.assertTrue(BallotBox.objects.get(id=deployed_ballot.id).finalized)
+        self.assertFalse(BallotBox.objects.get(id=ballot.id).finalized)
+    
+    def test_claim_deployment_once(self):
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        ballot.save()
+        job = enqueue_deployment(ballot)
+        
+        self.assertEqual(claim_next_job().id, job.id)
+        self.assertTrue(claim_next_job() is None)
+        self.assertNotEqual(enqueue_deployment(ballot).id, job.id)
+    
+    def test_expired_claim_is_claimed_again(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        job = enqueue_deployment(ballot)
+        
+        self.assertEqual(claim_next_job().id, job.id)
+        self.assertTrue(claim_next_job() is None)
+        
+        # The worker that claimed it died without sending it
+        DeploymentJob.objects.filter(id=job.id).update(claimed_datetime=timezone.now() - timedelta(seconds=settings.DEPLOYMENT_CLAIM_TIMEOUT + 1))
+        
+        self.assertEqual(claim_next_job().id, job.id)
+        self.assertTrue(claim_next_job() is None)
+    
+    def test_get_inexistent_deployment(self):
+        response = self.client.get('/api/deployments/1')
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_failed_deployment_hides_error_details(self):
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        rate_limited = requests.Response()
+        rate_limited.status_code = 429
+        error = requests.HTTPError('429 Client Error: Too Many Requests for url: https://node.example/v3/SECRETKEY', response=rate_limited)
+        
+        with self.assertLogs('api.deployment', level='ERROR') as logs:
+            job = fail_deployment_job(enqueue_deployment(ballot), error)
+        
+        self.assertEqual(job.error, 'HTTPError (status 429)')
+        self.assertIn('SECRETKEY', logs.output[0])
+        
+        # Only staff can see even the stored error
+        response = self.client.get('/api/deployments/' + str(job.id))
+        self.assertEqual(response.data['status'], DeploymentJob.FAILED)
+        self.assertIsNone(response.data['error'])
+        
+        self.client.force_authenticate(user=User.objects.create(username='admin', is_staff=True))
+        response = self.client.get('/api/deployments/' + str(job.id))
+        self.assertEqual(response.data['error'], 'HTTPError (status 429)')
+    
+    @override_settings(WEB3_RECEIPT_TIMEOUT=0)
+    def test_transaction_behind_nonce_gap_resyncs_nonce(self):
+        address = '0x' + '22' * 20
+        txn_hash = '0x' + '11' * 32
+        AccountNonce.objects.create(address=address, next_nonce=9)
+        pipeline = TransactionPipeline(None)
+        pipeline.track(txn_hash, mock.Mock(), address, 8)
+        
+        # The node has the transaction, but nonce 7 never reached it
+        with mock.patch('api.pipeline.get_transaction_receipts', return_value={}), \
+             mock.patch('api.pipeline.get_transaction_states', return_value=({txn_hash}, {address: (7, 7)})):
+            self.assertEqual(pipeline.poll(), [])
+        
+        self.assertTrue(pipeline.has_pending())
+        self.assertIsNone(AccountNonce.objects.get(address=address).next_nonce)
+
+class CandidateBulkCreateTest(APITestCase):
+    def test_bulk_create_candidates_from_json(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        candidates = [
+            {'name': 'Test Candidate ' + str(candidate_number), 'description': 'Test description for Test Candidate'}
+            for candidate_number in range(40)
+        ]
+        
+        response = self.client.post('/api/candidates/' + str(ballot.id) + '/bulk?finalize=true', candidates, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([candidate['pk_inside_ballot'] for candidate in response.data['candidates']], list(range(40)))
+        self.assertEqual(response.data['deployment']['status'], DeploymentJob.QUEUED)
+        self.assertEqual(Candidate.objects.filter(ballot_parent = ballot).count(), 40)
+        self.assertEqual(DeploymentJob.objects.filter(ballot = ballot).count(), 1)
+        self.assertTrue(BallotBox.objects.get(id = ballot.id).finalized)
+    
+    def test_bulk_create_candidates_from_csv_with_images(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        csv_candidates = 'name,description,img_path,website\nTest Candidate,Test description,first_image,\nTest Candidate 2,Test description,,https://example.com\n'
+        
+        response = self.client.post('/api/candidates/' + str(ballot.id) + '/bulk', {
+            'candidates': csv_candidates,
+            'format': 'csv',
+            'first_image': ImageFile(open('api/test/data/empty_user.png', 'rb')),
+        })
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['candidates']), 2)
+        self.assertTrue(response.data['deployment'] is None)
+        self.assertTrue(Candidate.objects.get(ballot_parent = ballot, pk_inside_ballot = 0).img_path.name.endswith('.png'))
+        self.assertEqual(Candidate.objects.get(ballot_parent = ballot, pk_inside_ballot = 1).website, 'https://example.com')
+    
+    def test_bulk_create_candidates_with_faulty_data(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        ballot = BallotBox.objects.create(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        ndjson_candidates = '{"name": "Test Candidate", "description": "Test description"}\n{"description": "Test description"}\n'
+        
+        response = self.client.post('/api/candidates/' + str(ballot.id) + '/bulk', ndjson_candidates, content_type='application/x-ndjson')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Candidate.objects.filter(ballot_parent = ballot).count(), 0)
+    
+class CandidateDeleteTest(APITestCase):
+    def test_delete_inexistent_or_existent_candidate_for_inexistent_ballot(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+
+        response = self.client.delete('/api/candidates/' + str(ballot.id + 1) + '/1')
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+    def test_delete_inexistent_candidate_for_ballot(self):
+        admin_user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin_user)
+        
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+
+        response = self.client.delete('/api/candidates/' + str(ballot.id) + '/1')
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+       
+    def test_delete_candidate_for_started_ballot(self):
         admin_user = User.objects.create(username='admin', is_staff=True)
         self.client.force_authenticate(user=admin_user)
         
@@ -660,4 +1567,750 @@ class ContratctAddressViewTest(APITestCase):
         response = self.client.get('/api/contract/' + str(ballot.id))
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['contract_address'], "0x71C7656EC7ab88b098defB751B7401B5f6d8976F")
\ No newline at end of file
+        self.assertEqual(response.data['contract_address'], "0x71C7656EC7ab88b098defB751B7401B5f6d8976F")
+
+# The test replica mirrors the default database, so the queries each connection gets show where reads were routed
+class ReplicaRouterTest(APITransactionTestCase):
+    databases = {'default', 'replica'}
+    
+    def setUp(self):
+        self.ballot = BallotBox(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+            contract_address = "0x71C7656EC7ab88b098defB751B7401B5f6d8976F"
+        )
+        self.ballot.save()
+        
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+    
+    def get(self, url):
+        with CaptureQueriesContext(connections['default']) as default_queries, CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(url)
+        
+        return response, len(default_queries), len(replica_queries)
+    
+    def test_reads_go_to_replica(self):
+        for url in ['/api/ballot', '/api/ballot/' + str(self.ballot.id), '/api/candidates/' + str(self.ballot.id), '/api/contract/' + str(self.ballot.id)]:
+            response, default_queries, replica_queries = self.get(url)
+            
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(default_queries, 0, url)
+            self.assertGreater(replica_queries, 0, url)
+    
+    def test_reads_after_write_go_to_primary(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.patch('/api/ballot/' + str(self.ballot.id), {'name': 'Changed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        response, default_queries, replica_queries = self.get('/api/ballot/' + str(self.ballot.id))
+        
+        self.assertEqual(response.data['name'], 'Changed')
+        self.assertGreater(default_queries, 0)
+        self.assertEqual(replica_queries, 0)
+    
+    def test_transactions_read_from_primary(self):
+        router = ReplicaRouter()
+        
+        with read_from('replica'):
+            self.assertEqual(router.db_for_read(BallotBox), 'replica')
+            self.assertEqual(router.db_for_write(BallotBox), 'default')
+            
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(BallotBox), 'default')
+                ballot = BallotBox.objects.select_for_update().get(id=self.ballot.id)
+        
+        self.assertEqual(router.db_for_read(BallotBox), 'default')
+        self.assertEqual(ballot._state.db, 'default')
+    
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'api_cache'}})
+    def test_database_cache_is_read_from_primary(self):
+        with read_from('replica'):
+            self.assertEqual(ReplicaRouter().db_for_read(caches['default'].cache_model_class), 'default')
+
+class ChainBatchCallTest(SimpleTestCase):
+    def setUp(self):
+        self.server, self.url = start_stub_rpc_server()
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_batch_call_uses_single_request(self):
+        w3 = Web3(PooledHTTPProvider(self.url, create_session()))
+        contract = get_artifact().get_contract(w3, "0x71C7656EC7ab88b098defB751B7401B5f6d8976F")
+        
+        counts = batch_call(w3, contract, [('getProposalVoteCount', [position, 0]) for position in range(30)])
+        
+        self.assertEqual(counts, [position + 5 for position in range(30)])
+        self.assertEqual(self.server.http_requests, 1)
+    
+    def test_transaction_receipts_use_single_request(self):
+        w3 = Web3(PooledHTTPProvider(self.url, create_session()))
+        txn_hashes = ['0x' + txn_number.to_bytes(32, 'big').hex() for txn_number in range(5)]
+        
+        receipts = get_transaction_receipts(w3, txn_hashes)
+        
+        self.assertIsNone(receipts[txn_hashes[0]])
+        self.assertEqual([receipts[txn_hash]['status'] for txn_hash in txn_hashes[1:]], [1, 1, 1, 1])
+        self.assertEqual(self.server.http_requests, 1)
+    
+    def test_async_call_sends_concurrent_requests(self):
+        w3 = Web3(PooledHTTPProvider(self.url, create_session()))
+        async_w3 = create_async_web3(create_endpoint_pool([self.url]))
+        contract = get_artifact().get_contract(w3, "0x71C7656EC7ab88b098defB751B7401B5f6d8976F")
+        
+        async def run():
+            try:
+                return await async_call(async_w3, contract, [('getProposalVoteCount', [position, 0]) for position in range(30)])
+            finally:
+                await async_w3.provider.get_session().close()
+        
+        with override_settings(WEB3_CONCURRENCY=5):
+            counts = async_to_sync(run)()
+        
+        self.assertEqual(counts, [position + 5 for position in range(30)])
+        self.assertEqual(self.server.http_requests, 30)
+    
+    def test_async_session_is_closed_with_its_loop(self):
+        w3 = Web3(PooledHTTPProvider(self.url, create_session()))
+        async_w3 = create_async_web3(create_endpoint_pool([self.url]))
+        contract = get_artifact().get_contract(w3, "0x71C7656EC7ab88b098defB751B7401B5f6d8976F")
+        
+        async def run():
+            counts = await async_call(async_w3, contract, [('getProposalVoteCount', [position, 0]) for position in range(3)])
+            self.assertIs(async_w3.provider.get_session(), async_w3.provider.get_session())
+            
+            return counts, async_w3.provider.get_session()
+        
+        # Each call runs on its own loop, as async views served by WSGI do
+        first_counts, first_session = async_to_sync(run)()
+        second_counts, second_session = async_to_sync(run)()
+        
+        self.assertEqual(first_counts, [5, 6, 7])
+        self.assertEqual(second_counts, [5, 6, 7])
+        self.assertIsNot(first_session, second_session)
+        self.assertTrue(first_session.closed)
+        self.assertTrue(second_session.closed)
+    
+    def test_web3_client_is_shared(self):
+        os.environ.setdefault('INFURA_API_KEY', 'test')
+        
+        self.assertIs(get_web3(), get_web3())
+        self.assertIs(get_web3().provider.session, get_web3().provider.session)
+
+class EndpointFailoverTest(SimpleTestCase):
+    def setUp(self):
+        self.server, self.url = start_stub_rpc_server()
+        self.limited_server, self.limited_url = start_stub_rpc_server(RateLimitedRPCHandler)
+    
+    def tearDown(self):
+        for server in [self.server, self.limited_server]:
+            server.shutdown()
+            server.server_close()
+    
+    def test_fastest_endpoint_is_used(self):
+        pool = EndpointPool(['http://slow', 'http://fast', 'http://unknown'])
+        slow, fast, unknown = pool.endpoints
+        pool.record_success(slow, 0.5)
+        pool.record_success(fast, 0.1)
+        
+        # Endpoints without measures are tried first, so they get one
+        self.assertEqual(pool.get_endpoints(), [unknown, fast, slow])
+    
+    def test_failing_endpoint_is_ejected_with_backoff(self):
+        now = [0]
+        pool = EndpointPool(['http://failing', 'http://working'], backoff=1, max_backoff=3, clock=lambda: now[0])
+        failing, working = pool.endpoints
+        pool.record_success(failing, 0.1)
+        pool.record_success(working, 0.5)
+        
+        pool.record_failure(failing)
+        pool.record_failure(failing)
+        
+        # Ejected endpoints are still tried when the others fail
+        self.assertEqual(pool.get_endpoints(), [working, failing])
+        now[0] = 1.5
+        self.assertEqual(pool.get_endpoints(), [working, failing])
+        now[0] = 2
+        self.assertEqual(pool.get_endpoints(), [failing, working])
+        
+        pool.record_failure(failing)
+        pool.record_failure(failing)
+        self.assertEqual(failing.ejected_until, 5)
+    
+    def test_rate_limited_endpoint_fails_over(self):
+        w3 = create_web3(create_endpoint_pool([self.limited_url, self.url]))
+        contract = get_artifact().get_contract(w3, "0x71C7656EC7ab88b098defB751B7401B5f6d8976F")
+        
+        for _ in range(3):
+            counts = batch_call(w3, contract, [('getProposalVoteCount', [position, 0]) for position in range(3)])
+            self.assertEqual(counts, [5, 6, 7])
+        
+        # Once ejected, the rate limited endpoint isn't called again
+        self.assertEqual(self.limited_server.http_requests, 1)
+        self.assertEqual(self.server.http_requests, 3)
+    
+    def test_local_node_backend(self):
+        with override_settings(WEB3_PROVIDER_URLS=[self.url]), mock.patch.dict(os.environ, {'ACCOUNT_KEY': ''}):
+            backend = LocalNodeBackend()
+            contract = get_artifact().get_contract(backend.create_web3(), "0x71C7656EC7ab88b098defB751B7401B5f6d8976F")
+            
+            self.assertEqual(batch_call(backend.create_web3(), contract, [('getProposalVoteCount', [position, 0]) for position in range(3)]), [5, 6, 7])
+            # Transactions are sent from the first prefunded account of the node
+            self.assertEqual(Account.from_key(backend.get_account_key()).address, '0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266')
+        
+        with override_settings(WEB3_PROVIDER_URLS=[]):
+            self.assertEqual(LocalNodeBackend().get_provider_urls(), ['http://127.0.0.1:8545'])
+
+class ContractRegistryTest(SimpleTestCase):
+    def test_get_current_artifact(self):
+        artifact = get_artifact()
+        
+        self.assertIs(artifact, get_artifact(artifact.version))
+        self.assertIs(get_abi(), artifact.abi)
+        self.assertEqual(get_bytecode(), artifact.bytecode)
+    
+    def test_get_inexistent_artifact(self):
+        with self.assertRaises(ContractArtifactError):
+            get_artifact('0' * 64)
+    
+    def test_invalid_artifact(self):
+        with self.assertRaises(ContractArtifactError):
+            ContractArtifact('Invalid', [{'type': 'function', 'name': 'vote'}], get_bytecode())
+    
+    def test_contract_factory_is_reused(self):
+        w3 = Web3(PooledHTTPProvider('http://127.0.0.1:8545', create_session()))
+        
+        self.assertIs(get_artifact().get_factory(w3), get_artifact().get_factory(w3))
+
+# Runs the results stream of a ballot for every subscriber at the same time. They all disconnect once every one of them
+# has received a counts event (or when the stream ends if disconnect is False), and the messages sent to each one are
+# returned
+def run_results_stream(ballot_id, subscribers=1, disconnect=True):
+    application = ResultsStreamRouter(None)
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/ballot/' + str(ballot_id) + '/stream'}
+    received = set()
+    received_event = None
+    
+    async def subscribe(subscriber):
+        messages = []
+        
+        async def receive():
+            await received_event.wait()
+            return {'type': 'http.disconnect'}
+        
+        async def send(message):
+            messages.append(message)
+            if disconnect and message.get('body', b'').startswith(b'event: counts'):
+                received.add(subscriber)
+                if len(received) == subscribers:
+                    received_event.set()
+        
+        await application(scope, receive, send)
+        return messages
+    
+    async def run():
+        nonlocal received_event
+        received_event = asyncio.Event()
+        return await asyncio.gather(*[subscribe(subscriber) for subscriber in range(subscribers)])
+    
+    return async_to_sync(run)()
+
+@override_settings(RESULTS_STREAM_INTERVAL=0.01)
+class ResultsStreamTest(APITransactionTestCase):
+    def test_stream_inexistent_ballot(self):
+        messages, = run_results_stream(1)
+        
+        self.assertEqual(messages[0]['status'], status.HTTP_404_NOT_FOUND)
+    
+    def test_stream_is_shared_by_subscribers(self):
+        start_datetime = timezone.now() - timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            contract_address = '0x0000000000000000000000000000000000000001',
+        )
+        
+        ballot.save()
+        
+        for candidate_number in range(2):
+            candidate = Candidate(
+                name = 'Test Candidate ' + str(candidate_number),
+                img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+                description = 'Test description for Test Candidate',
+                ballot_parent = ballot,
+                pk_inside_ballot = candidate_number
+            )
+            candidate.save()
+            LiveTally.objects.create(candidate = candidate, votes = candidate_number + 1, block_number = 100)
+        
+        # However many subscribers there are, the counts are read once per interval
+        with mock.patch('api.streams.read_ballot_counts', wraps=read_ballot_counts) as read_counts:
+            subscribers_messages = run_results_stream(ballot.id, subscribers=10)
+        
+        self.assertEqual(read_counts.call_count, 1)
+        for messages in subscribers_messages:
+            self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+            self.assertEqual(dict(messages[0]['headers'])[b'content-type'], b'text/event-stream')
+            self.assertEqual(messages[1]['body'], b'event: counts\ndata: {"counts": {"0": 1, "1": 2}, "block_number": 100}\n\n')
+    
+    def test_stream_finished_ballot(self):
+        start_datetime = timezone.now() - timedelta(hours=10)
+        end_datetime = timezone.now() - timedelta(hours=1)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            contract_address = '0x0000000000000000000000000000000000000001',
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        CandidateResult.objects.create(candidate = candidate, votes = 7)
+        
+        messages, = run_results_stream(ballot.id, disconnect=False)
+        
+        # The final counts end the stream
+        self.assertEqual(messages[-2]['body'], b'event: finished\ndata: {"counts": {"0": 7}}\n\n')
+        self.assertFalse(messages[-1].get('more_body', False))
+    
+    def test_stream_reads_check_connections(self):
+        start_datetime = timezone.now() - timedelta(hours=10)
+        end_datetime = timezone.now() - timedelta(hours=1)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+            contract_address = '0x0000000000000000000000000000000000000001',
+        )
+        
+        ballot.save()
+        
+        # Each read runs outside of any request, so its connections are checked before it and recycled after it
+        with mock.patch('api.streams.close_unusable_connections') as close_unusable, \
+             mock.patch('api.streams.close_old_connections') as close_old:
+            run_results_stream(ballot.id, disconnect=False)
+        
+        self.assertEqual(close_unusable.call_count, 1)
+        self.assertEqual(close_old.call_count, 1)
+
+@skipUnless(importlib.util.find_spec('eth_tester'), 'The tester chain needs web3[tester] (pip install -r requirements-dev.txt)')
+@override_settings(WEB3_BACKEND='api.backends.TesterBackend')
+class TesterChainTest(APITestCase):
+    def test_deploy_vote_and_count(self):
+        start_datetime = timezone.now() - timedelta(minutes=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        )
+        
+        ballot.save()
+        
+        for candidate_number in range(3):
+            candidate = Candidate(
+                name = 'Test Candidate ' + str(candidate_number),
+                img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+                description = 'Test description for Test Candidate',
+                ballot_parent = ballot,
+                pk_inside_ballot = candidate_number
+            )
+            candidate.save()
+        
+        finalize_ballot(ballot)
+        pipeline = TransactionPipeline(get_web3())
+        job = submit_deployment_job(claim_next_job(), pipeline)
+        
+        self.assertEqual(job.status, DeploymentJob.SUBMITTED)
+        self.assertEqual(pipeline.poll(), [job])
+        self.assertEqual(job.status, DeploymentJob.MINED)
+        
+        ballot.refresh_from_db()
+        w3 = get_web3()
+        contract = get_artifact(ballot.contract_version).get_contract(w3, ballot.contract_address)
+        admin_account = get_admin_account(w3)
+        for position in [2, 2, 0]:
+            contract.functions.vote(position, int(timezone.now().timestamp())).transact({'from': admin_account.address})
+        
+        self.assertTrue(refresh_tallies(ballot))
+        
+        response = self.client.get('/api/ballot/' + str(ballot.id))
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([candidate["result"] for candidate in response.data['candidates']], [1, 0, 2])
+    
+    def test_reclaimed_deployment_is_not_sent_again(self):
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        finalize_ballot(ballot)
+        
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        first_nonce = w3.eth.get_transaction_count(admin_account.address)
+        
+        # The worker dies right after sending the deployment, before marking the job as submitted
+        class WorkerDied(BaseException):
+            pass
+        
+        pipeline = TransactionPipeline(w3)
+        def submit_and_die(*args):
+            TransactionPipeline.submit(pipeline, *args)
+            raise WorkerDied()
+        
+        with mock.patch.object(pipeline, 'submit', side_effect=submit_and_die), self.assertRaises(WorkerDied):
+            submit_deployment_job(claim_next_job(), pipeline)
+        
+        job = DeploymentJob.objects.get(ballot=ballot)
+        self.assertEqual(job.status, DeploymentJob.QUEUED)
+        self.assertIsNotNone(job.txn_hash)
+        
+        DeploymentJob.objects.filter(id=job.id).update(claimed_datetime=timezone.now() - timedelta(seconds=settings.DEPLOYMENT_CLAIM_TIMEOUT + 1))
+        pipeline = TransactionPipeline(w3)
+        reclaimed_job = submit_deployment_job(claim_next_job(), pipeline)
+        
+        self.assertEqual(reclaimed_job.txn_hash, job.txn_hash)
+        self.assertEqual(pipeline.poll(), [reclaimed_job])
+        self.assertEqual(reclaimed_job.status, DeploymentJob.MINED)
+        self.assertEqual(w3.eth.get_transaction_count(admin_account.address), first_nonce + 1)
+    
+    def test_deployments_share_receipt_poll(self):
+        start_datetime = timezone.now() + timedelta(hours=1)
+        end_datetime = timezone.now() + timedelta(hours=10)
+        
+        for ballot_number in range(3):
+            ballot = BallotBox(
+                name = 'Test ' + str(ballot_number),
+                start_datetime = start_datetime,
+                end_datetime = end_datetime,
+            )
+            
+            candidate = Candidate(
+                name = 'Test Candidate',
+                img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+                description = 'Test description for Test Candidate',
+                ballot_parent = ballot,
+                pk_inside_ballot = 0
+            )
+            
+            ballot.save()
+            candidate.save()
+            finalize_ballot(ballot)
+        
+        pipeline = TransactionPipeline(get_web3())
+        jobs = [submit_deployment_job(claim_next_job(), pipeline) for _ in range(3)]
+        
+        # Every pending deployment is completed by a single poll
+        with mock.patch('api.pipeline.get_transaction_receipts', wraps=get_transaction_receipts) as get_receipts:
+            completed_jobs = pipeline.poll()
+        
+        self.assertEqual(get_receipts.call_count, 1)
+        self.assertEqual(completed_jobs, jobs)
+        self.assertFalse(pipeline.has_pending())
+        self.assertEqual(DeploymentJob.objects.filter(status=DeploymentJob.MINED).count(), 3)
+        self.assertEqual(BallotBox.objects.filter(contract_address__isnull=False).count(), 3)
+    
+    @override_settings(WEB3_RECEIPT_TIMEOUT=0)
+    def test_pending_deployment_is_tracked_after_timeout(self):
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        finalize_ballot(ballot)
+        
+        w3 = get_web3()
+        pipeline = TransactionPipeline(w3)
+        
+        # The node still has the transaction, so it may yet be mined
+        w3.provider.ethereum_tester.disable_auto_mine_transactions()
+        try:
+            job = submit_deployment_job(claim_next_job(), pipeline)
+            
+            self.assertEqual(pipeline.poll(), [])
+            self.assertTrue(pipeline.has_pending())
+        finally:
+            w3.provider.ethereum_tester.enable_auto_mine_transactions()
+        
+        self.assertEqual(pipeline.poll(), [job])
+        self.assertEqual(job.status, DeploymentJob.MINED)
+    
+    def test_unconfirmed_deployment_is_tracked(self):
+        ballot = BallotBox(
+            name = 'Test',
+            start_datetime = timezone.now() + timedelta(hours=1),
+            end_datetime = timezone.now() + timedelta(hours=10),
+        )
+        
+        candidate = Candidate(
+            name = 'Test Candidate',
+            img_path = ImageFile(open('api/test/data/empty_user.png', 'rb')),
+            description = 'Test description for Test Candidate',
+            ballot_parent = ballot,
+            pk_inside_ballot = 0
+        )
+        
+        ballot.save()
+        candidate.save()
+        finalize_ballot(ballot)
+        
+        w3 = get_web3()
+        pipeline = TransactionPipeline(w3)
+        send_raw_transaction = w3.eth.send_raw_transaction
+        
+        # The node takes the deployment, but neither sending it nor looking it up get an answer
+        def send_and_time_out(raw_txn):
+            send_raw_transaction(raw_txn)
+            raise requests.Timeout()
+        
+        with mock.patch.object(w3.eth, 'send_raw_transaction', side_effect=send_and_time_out), \
+             mock.patch.object(w3.eth, 'get_transaction', side_effect=requests.ConnectionError()):
+            job = submit_deployment_job(claim_next_job(), pipeline)
+        
+        self.assertEqual(job.status, DeploymentJob.SUBMITTED)
+        self.assertEqual(pipeline.poll(), [job])
+        self.assertEqual(job.status, DeploymentJob.MINED)
+    
+    @override_settings(WEB3_RECEIPT_TIMEOUT=0)
+    def test_dropped_transaction_is_given_up_once_its_nonce_is_used(self):
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        nonce = w3.eth.get_transaction_count(admin_account.address)
+        callback = mock.Mock(return_value='given up')
+        
+        # A transaction the node doesn't know, whose nonce no other transaction has used yet
+        pipeline = TransactionPipeline(w3)
+        pipeline.track('0x' + '11' * 32, callback, admin_account.address, nonce)
+        AccountNonce.objects.create(address=admin_account.address, next_nonce=nonce + 1)
+        
+        self.assertEqual(pipeline.poll(), [])
+        self.assertIsNone(AccountNonce.objects.get(address=admin_account.address).next_nonce)
+        
+        # The next transaction takes its nonce, so it can never be mined
+        send_transaction(w3, admin_account, {'from': admin_account.address, 'to': w3.eth.accounts[1], 'value': 1, 'gas': 21000, 'chainId': w3.eth.chain_id, 'maxFeePerGas': 10 ** 10, 'maxPriorityFeePerGas': 1})
+        
+        self.assertEqual(pipeline.poll(), ['given up'])
+        callback.assert_called_once_with(None)
+        self.assertFalse(pipeline.has_pending())
+
+@skipUnless(importlib.util.find_spec('eth_tester'), 'The tester chain needs web3[tester] (pip install -r requirements-dev.txt)')
+@override_settings(WEB3_BACKEND='api.backends.TesterBackend')
+class NonceManagerTest(APITestCase):
+    def get_transfer(self, w3, admin_account):
+        return {'from': admin_account.address, 'to': w3.eth.accounts[1], 'value': 1, 'gas': 21000, 'chainId': w3.eth.chain_id, 'maxFeePerGas': 10 ** 10, 'maxPriorityFeePerGas': 1}
+    
+    def test_nonces_are_allocated_locally(self):
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        first_nonce = w3.eth.get_transaction_count(admin_account.address)
+        
+        # The chain is only asked for the first nonce
+        with mock.patch.object(w3.eth, 'get_transaction_count', wraps=w3.eth.get_transaction_count) as get_transaction_count:
+            txn_hashes = [send_transaction(w3, admin_account, self.get_transfer(w3, admin_account)) for _ in range(5)]
+        
+        self.assertEqual(get_transaction_count.call_count, 1)
+        self.assertEqual([w3.eth.get_transaction(txn_hash)['nonce'] for txn_hash in txn_hashes], list(range(first_nonce, first_nonce + 5)))
+        self.assertEqual(AccountNonce.objects.get(address=admin_account.address).next_nonce, first_nonce + 5)
+    
+    def test_rejected_transaction_resyncs_nonce(self):
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        first_nonce = w3.eth.get_transaction_count(admin_account.address)
+        send_transaction(w3, admin_account, self.get_transfer(w3, admin_account))
+        
+        # A transaction sent by other means takes the nonce the manager would give next
+        txn = self.get_transfer(w3, admin_account)
+        txn['nonce'] = first_nonce + 1
+        txn['value'] = 2
+        w3.eth.send_raw_transaction(admin_account.signTransaction(txn).rawTransaction)
+        
+        txn_hash = send_transaction(w3, admin_account, self.get_transfer(w3, admin_account))
+        
+        self.assertEqual(w3.eth.get_transaction(txn_hash)['nonce'], first_nonce + 2)
+        self.assertEqual(w3.eth.get_transaction_receipt(txn_hash)['status'], 1)
+        self.assertEqual(AccountNonce.objects.get(address=admin_account.address).next_nonce, first_nonce + 3)
+    
+    def test_failed_request_taken_by_node_is_not_sent_again(self):
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        first_nonce = w3.eth.get_transaction_count(admin_account.address)
+        send_raw_transaction = w3.eth.send_raw_transaction
+        
+        # The node takes the transaction, but the request times out before it answers
+        def send_and_time_out(raw_txn):
+            send_raw_transaction(raw_txn)
+            raise requests.Timeout()
+        
+        with mock.patch.object(w3.eth, 'send_raw_transaction', side_effect=send_and_time_out) as send:
+            txn_hash = send_transaction(w3, admin_account, self.get_transfer(w3, admin_account))
+        
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(w3.eth.get_transaction(txn_hash)['nonce'], first_nonce)
+        self.assertEqual(w3.eth.get_transaction_count(admin_account.address), first_nonce + 1)
+        self.assertEqual(AccountNonce.objects.get(address=admin_account.address).next_nonce, first_nonce + 1)
+    
+    def test_failed_request_is_sent_again_with_same_nonce(self):
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        first_nonce = w3.eth.get_transaction_count(admin_account.address)
+        send_raw_transaction = w3.eth.send_raw_transaction
+        
+        failures = [requests.ConnectionError()]
+        
+        # The node never gets the first request
+        def fail_once(raw_txn):
+            if failures:
+                raise failures.pop()
+            return send_raw_transaction(raw_txn)
+        
+        with mock.patch.object(w3.eth, 'send_raw_transaction', side_effect=fail_once) as send:
+            txn_hash = send_transaction(w3, admin_account, self.get_transfer(w3, admin_account))
+        
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(send.call_args_list[0], send.call_args_list[1])
+        self.assertEqual(w3.eth.get_transaction(txn_hash)['nonce'], first_nonce)
+        self.assertEqual(AccountNonce.objects.get(address=admin_account.address).next_nonce, first_nonce + 1)
+    
+    def test_nonce_rejection_of_transaction_taken_by_node_is_not_sent_again(self):
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        first_nonce = w3.eth.get_transaction_count(admin_account.address)
+        send_raw_transaction = w3.eth.send_raw_transaction
+        
+        # The failover provider sends the transaction again to another node after the first one took it and failed
+        # to answer, and the transaction has been mined by then
+        def send_and_fail_over(raw_txn):
+            send_raw_transaction(raw_txn)
+            raise ValueError({'code': -32000, 'message': 'nonce too low'})
+        
+        with mock.patch.object(w3.eth, 'send_raw_transaction', side_effect=send_and_fail_over) as send:
+            txn_hash = send_transaction(w3, admin_account, self.get_transfer(w3, admin_account))
+        
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(w3.eth.get_transaction(txn_hash)['nonce'], first_nonce)
+        self.assertEqual(w3.eth.get_transaction_count(admin_account.address), first_nonce + 1)
+    
+    def test_unconfirmed_transaction_resyncs_nonce(self):
+        w3 = get_web3()
+        admin_account = get_admin_account(w3)
+        send_transaction(w3, admin_account, self.get_transfer(w3, admin_account))
+        
+        # Neither the transaction nor looking it up afterwards reach the node
+        with mock.patch.object(w3.eth, 'send_raw_transaction', side_effect=requests.ConnectionError()), \
+             mock.patch.object(w3.eth, 'get_transaction', side_effect=requests.ConnectionError()), \
+             self.assertRaises(UnconfirmedTransaction) as raised:
+            send_transaction(w3, admin_account, self.get_transfer(w3, admin_account))
+        
+        self.assertIsNotNone(raised.exception.txn_hash)
+        self.assertIsNone(AccountNonce.objects.get(address=admin_account.address).next_nonce)
+
+class ConnectionHealthCheckTest(SimpleTestCase):
+    def get_connection(self, health_checks=True, connected=True, usable=True, in_atomic_block=False):
+        connection = mock.Mock(in_atomic_block=in_atomic_block, settings_dict={'CONN_HEALTH_CHECKS': health_checks})
+        connection.connection = object() if connected else None
+        connection.is_usable.return_value = usable
+        
+        return connection
+    
+    def test_unusable_connections_are_closed(self):
+        usable = self.get_connection()
+        unusable = self.get_connection(usable=False)
+        
+        with mock.patch('api.database.connections') as connections:
+            connections.all.return_value = [usable, unusable]
+            close_unusable_connections()
+        
+        usable.close.assert_not_called()
+        unusable.close.assert_called_once()
+    
+    def test_skipped_connections_are_not_checked(self):
+        not_connected = self.get_connection(connected=False)
+        not_checked = self.get_connection(health_checks=False, usable=False)
+        in_transaction = self.get_connection(in_atomic_block=True, usable=False)
+        
+        with mock.patch('api.database.connections') as connections:
+            connections.all.return_value = [not_connected, not_checked, in_transaction]
+            close_unusable_connections()
+        
+        for connection in [not_connected, not_checked, in_transaction]:
+            connection.is_usable.assert_not_called()
+            connection.close.assert_not_called()
+
+# Loads the app and its URLs in a new process (as a worker or management command does when it starts), and prints the
+# seconds it took and which of the blockchain modules got imported
+IMPORT_SCRIPT = """
+import django, json, sys, time
+start = time.perf_counter()
+django.setup()
+import ballot_mgmt.urls
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': [module for module in ('web3', 'eth_account', 'aiohttp', 'api.chain') if module in sys.modules]}))
+"""
+
+class ImportTimeTest(SimpleTestCase):
+    # Seconds the app can take to load. Without the blockchain stack it takes about a third of that
+    IMPORT_BUDGET = 1.5
+    
+    def test_startup_skips_blockchain_stack(self):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'ballot_mgmt.settings', 'DJANGO_PROFILE': 'prod'}
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True).stdout
+        startup = json.loads(output)
+        
+        self.assertEqual(startup['modules'], [])
+        self.assertLess(startup['seconds'], self.IMPORT_BUDGET)
+
+# Loads the settings of the prod profile in a new process, with the given environment, and returns the chosen value
+def get_prod_setting(name, **environment):
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'ballot_mgmt.settings', 'DJANGO_PROFILE': 'prod', **environment}
+    script = 'from django.conf import settings; print(settings.' + name + ')'
+    
+    return subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True).stdout.strip()
+
+class ProdSettingsTest(SimpleTestCase):
+    def test_sessions_are_cached_with_shared_cache(self):
+        self.assertEqual(get_prod_setting('SESSION_ENGINE'), 'django.contrib.sessions.backends.cached_db')
+    
+    # A logout would only reach the cache of the worker that served it
+    def test_sessions_are_not_cached_with_local_cache(self):
+        session_engine = get_prod_setting('SESSION_ENGINE', CACHE_BACKEND='django.core.cache.backends.locmem.LocMemCache', WEB_CONCURRENCY='1')
+        
+        self.assertEqual(session_engine, 'django.contrib.sessions.backends.db')
@@ -1,12 +1,23 @@
 from datetime import datetime, timezone
-from rest_framework import viewsets, permissions, authentication, mixins, response, status
-from django import http, shortcuts
-from .models import BallotBox, Candidate
-from .serializers import BallotBoxCreateOrUpdateSerializer, BallotBoxListSerializer, BallotBoxRetrieveSerializer, BallotBoxContractAddressSerializer, CandidateCreateSerializer, CandidateListSerializer
+from rest_framework import viewsets, permissions, authentication, mixins, response, status, decorators, exceptions, parsers
+from django import shortcuts
+from django.conf import settings
+from django.utils.timezone import now as timezone_now
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from .cache import BALLOT_LIST_SCOPE, cache_response, get_ballot_scope, get_ballot_timeout, get_cache_key, get_cached_response
+from .conditional import FINISHED, get_ballot_etag, get_ballot_last_modified, get_ballot_list_etag, get_ballot_phase, get_not_modified_response, set_conditional_headers
+from .deployment import finalize_ballot
+from .models import BallotBox, Candidate, DeploymentJob
+from .pagination import BallotBoxCursorPagination
+from .parsers import CSVParser, NDJSONParser, parse_candidate_rows
+from .replicas import ReplicaReadMixin
+from .serializers import BallotBoxCreateOrUpdateSerializer, BallotBoxListSerializer, BallotBoxRetrieveSerializer, BallotBoxContractAddressSerializer, CandidateCreateSerializer, CandidateBulkCreateSerializer, CandidateListSerializer, DeploymentJobSerializer
 
 # Create your views here.
-class BallotBoxView(viewsets.ModelViewSet):
+class BallotBoxView(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = BallotBox.objects.all()
+    pagination_class = BallotBoxCursorPagination
     permission_classes = [permissions.IsAdminUser|permissions.IsAuthenticatedOrReadOnly]
     authentication_classes = [authentication.SessionAuthentication, authentication.TokenAuthentication]
     
@@ -17,12 +28,68 @@ class BallotBoxView(viewsets.ModelViewSet):
             return BallotBoxRetrieveSerializer
         if(self.action == 'create' or self.action == 'update' or self.action == 'partial_update'):
             return BallotBoxCreateOrUpdateSerializer
+        if(self.action == 'finalize'):
+            return DeploymentJobSerializer
+    
+    def get_queryset(self):
+        if(self.action == 'list'):
+            return self.filter_by_status(super().get_queryset())
+        
+        return super().get_queryset()
+    
+    # Ballots can be filtered with ?status=upcoming|active|finished
+    def filter_by_status(self, queryset):
+        ballot_status = self.request.query_params.get('status')
+        now = datetime.now(timezone.utc)
+        
+        if ballot_status is None:
+            return queryset
+        if ballot_status == 'upcoming':
+            return queryset.filter(start_datetime__gt=now)
+        if ballot_status == 'active':
+            return queryset.filter(start_datetime__lte=now, end_datetime__gte=now)
+        if ballot_status == 'finished':
+            return queryset.filter(end_datetime__lt=now)
         
+        raise exceptions.ValidationError({'status': 'Status must be upcoming, active or finished'})
+    
+    # Clients polling the list get a 304 without serializing anything while no ballot changes.
+    # Responses are also cached until a ballot changes (shortly if filtered by status, as that changes with time)
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        cache_key = get_cache_key(request, BALLOT_LIST_SCOPE)
+        cached_response = get_cached_response(request, cache_key)
+        if cached_response is not None:
+            return cached_response
+        
+        etag, last_modified = get_ballot_list_etag(request)
+        not_modified = get_not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        list_response = set_conditional_headers(super().list(request, *args, **kwargs), etag, last_modified)
+        timeout = settings.API_CACHE_ACTIVE_TIMEOUT if 'status' in request.query_params else settings.API_CACHE_TIMEOUT
+        
+        return cache_response(cache_key, list_response, timeout)
     
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        cache_key = get_cache_key(request, get_ballot_scope(kwargs['pk']))
+        cached_response = get_cached_response(request, cache_key)
+        if cached_response is not None:
+            return cached_response
+        
+        ballot = self.get_object()
+        etag = get_ballot_etag(ballot)
+        last_modified = get_ballot_last_modified(ballot)
+        not_modified = get_not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        # Candidates (and their stored results and counts) are loaded with a single query, so serializing doesn't make a query per candidate
+        prefetch_related_objects([ballot], Prefetch('candidate_set', queryset=Candidate.objects.select_related('candidate_result', 'live_tally').order_by('pk_inside_ballot')))
+        serializer = self.get_serializer(ballot)
+        retrieve_response = set_conditional_headers(response.Response(serializer.data), etag, last_modified, immutable=get_ballot_phase(ballot) == FINISHED)
+        
+        return cache_response(cache_key, retrieve_response, get_ballot_timeout(ballot, timezone_now()))
     
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
@@ -31,6 +98,8 @@ class BallotBoxView(viewsets.ModelViewSet):
         ballot = shortcuts.get_object_or_404(BallotBox, id=kwargs['pk'])
         if ballot.start_datetime < datetime.now(timezone.utc):
             return response.Response("Votation " + str(ballot.id) + " has started and can't be changed", status.HTTP_409_CONFLICT)
+        if ballot.finalized:
+            return response.Response("Votation " + str(ballot.id) + " has been finalized and can't be changed", status.HTTP_409_CONFLICT)
         
         return super().update(request, *args, **kwargs)
     
@@ -44,44 +113,51 @@ class BallotBoxView(viewsets.ModelViewSet):
         
         return super().destroy(request, *args, **kwargs)
     
+    # Deploys the contract with every candidate of the ballot. After this, candidates and dates can't be changed
+    @decorators.action(detail=True, methods=['post'])
+    def finalize(self, request, *args, **kwargs):
+        ballot = shortcuts.get_object_or_404(BallotBox, id=kwargs['pk'])
+        if ballot.start_datetime < datetime.now(timezone.utc):
+            return response.Response("Votation " + str(ballot.id) + " has started and can't be changed", status.HTTP_409_CONFLICT)
+        # A finalized ballot can only be finalized again if its deployment failed
+        if ballot.finalized and ballot.deployment_jobs.exclude(status=DeploymentJob.FAILED).exists():
+            return response.Response("Votation " + str(ballot.id) + " has already been finalized", status.HTTP_409_CONFLICT)
+        if not Candidate.objects.filter(ballot_parent=ballot).exists():
+            return response.Response("Votation " + str(ballot.id) + " has no candidates", status.HTTP_400_BAD_REQUEST)
+        
+        deployment = finalize_ballot(ballot)
+        
+        return response.Response(DeploymentJobSerializer(deployment, context={'request': request}).data, status.HTTP_202_ACCEPTED, headers={'Location': '/api/deployments/' + str(deployment.id)})
+
 # Instead of inherit from ModelViewSet, we inherit from only necesary mixins
-class CandidateView(mixins.ListModelMixin,
+class CandidateView(ReplicaReadMixin,
+                    mixins.ListModelMixin,
                     mixins.CreateModelMixin,
                     mixins.DestroyModelMixin,
                     viewsets.GenericViewSet):
     permission_classes = [permissions.IsAdminUser|permissions.IsAuthenticatedOrReadOnly]
     authentication_classes = [authentication.SessionAuthentication, authentication.TokenAuthentication]
     
-    # As we don't want all candidates, instead of using queryset attribute, we have get filter the ones we want
+    replica_actions = ('list',)
+    
+    def get_read_scope(self, kwargs):
+        return get_ballot_scope(kwargs['bk'])
+    
+    # As we don't want all candidates, instead of using queryset attribute, we have get filter the ones we want.
+    # The queryset is lazy, so pagination and filtering are applied on the database
     def get_queryset(self):
-        try:
-            return shortcuts.get_list_or_404(Candidate, ballot_parent_id=self.kwargs['bk'])
-        except:
-            try:
-                shortcuts.get_object_or_404(BallotBox, id=self.kwargs['bk'])
-                return []
-            except:
-                raise http.Http404
+        return Candidate.objects.filter(ballot_parent_id=self.kwargs['bk']).order_by('pk_inside_ballot')
     
     def get_object(self):
-        try:
-            return shortcuts.get_object_or_404(Candidate, ballot_parent_id = self.kwargs['bk'], pk_inside_ballot = self.kwargs['pk'])
-        except:
-            raise http.Http404
+        return shortcuts.get_object_or_404(self.get_queryset(), pk_inside_ballot = self.kwargs['pk'])
     
-    # As the ballot and the candidate number on ballot aren't provided by the user, we pass them to the serializer as context on POST calls
+    # As the ballot isn't provided by the user, we pass it to the serializer as context on POST calls
     def get_serializer_context(self):
         context = super().get_serializer_context()
         
         if(self.action == 'create'):
             context.update({"ballot_parent_id": self.kwargs['bk']})
-            last_candidate_for_ballot = Candidate.objects.order_by('pk_inside_ballot').filter(ballot_parent_id=self.kwargs['bk']).last()
-            
-            if last_candidate_for_ballot is not None:
-                context.update({"last_candidate_id": last_candidate_for_ballot.pk_inside_ballot})
-            else:
-                context.update({"last_candidate_id": -1})
-            
+        
         return context
     
     def get_serializer_class(self):
@@ -89,34 +165,120 @@ class CandidateView(mixins.ListModelMixin,
             return CandidateListSerializer
         if(self.action == 'create'):
             return CandidateCreateSerializer
+        if(self.action == 'bulk'):
+            return CandidateBulkCreateSerializer
     
+    # The ballot is read first, which checks it exists and gives the version for the ETag.
+    # Candidates are only read (with a single query) when the client copy is outdated
     def list(self, request, *args, **kwargs):
-        return super().list(self, request, *args, **kwargs)
+        cache_key = get_cache_key(request, get_ballot_scope(kwargs['bk']))
+        cached_response = get_cached_response(request, cache_key)
+        if cached_response is not None:
+            return cached_response
+        
+        ballot = shortcuts.get_object_or_404(BallotBox.objects.only('id', 'start_datetime', 'end_datetime', 'version', 'updated_datetime'), id=kwargs['bk'])
+        etag = get_ballot_etag(ballot)
+        last_modified = get_ballot_last_modified(ballot)
+        not_modified = get_not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        list_response = set_conditional_headers(super().list(request, *args, **kwargs), etag, last_modified)
+        
+        return cache_response(cache_key, list_response, get_ballot_timeout(ballot, timezone_now()))
     
     def create(self, request, *args, **kwargs):
         ballot = shortcuts.get_object_or_404(BallotBox, id=kwargs['bk'])
         if ballot.start_datetime < datetime.now(timezone.utc):
             return response.Response("Votation " + str(ballot.id) + " has started and can't be changed", status.HTTP_409_CONFLICT)
+        if ballot.finalized:
+            return response.Response("Votation " + str(ballot.id) + " has been finalized and can't be changed", status.HTTP_409_CONFLICT)
+        
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        
+        # Only the new candidate is returned, the whole list can be read from the list endpoint
+        data = CandidateListSerializer(serializer.instance).data
+        
+        return response.Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+    
+    # Imports many candidates at once from a JSON array, CSV or NDJSON body. Images can be uploaded with a multipart form,
+    # sending the candidates in a "candidates" field (text or file, with its format in a "format" field or the file extension)
+    # and each image as a file whose field name is the img_path of its candidate.
+    # Candidates are inserted with a single query and, with ?finalize=true, the ballot is finalized (and deployed once) afterwards
+    @decorators.action(detail=False, methods=['post'], parser_classes=[parsers.JSONParser, CSVParser, NDJSONParser, parsers.MultiPartParser])
+    def bulk(self, request, *args, **kwargs):
+        ballot = shortcuts.get_object_or_404(BallotBox, id=kwargs['bk'])
+        if ballot.start_datetime < datetime.now(timezone.utc):
+            return response.Response("Votation " + str(ballot.id) + " has started and can't be changed", status.HTTP_409_CONFLICT)
+        if ballot.finalized:
+            return response.Response("Votation " + str(ballot.id) + " has been finalized and can't be changed", status.HTTP_409_CONFLICT)
+        
+        context = self.get_serializer_context()
+        context.update({"ballot_parent": ballot})
+        serializer = CandidateBulkCreateSerializer(data=self.get_bulk_rows(request), many=True, allow_empty=False, context=context)
+        serializer.is_valid(raise_exception=True)
         
-        super().create(request, *args, **kwargs)
+        with transaction.atomic():
+            first_pk_inside_ballot = ballot.allocate_pks_inside_ballot(len(serializer.validated_data))
+            candidates = Candidate.objects.bulk_create([
+                Candidate(pk_inside_ballot=first_pk_inside_ballot + position, **candidate_data)
+                for position, candidate_data in enumerate(serializer.validated_data)
+            ])
         
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
+        deployment = None
+        if request.query_params.get('finalize') == 'true':
+            deployment = finalize_ballot(ballot)
         
-        return response.Response(serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+        return response.Response({
+            'candidates': CandidateListSerializer(candidates, many=True).data,
+            'deployment': DeploymentJobSerializer(deployment, context={'request': request}).data if deployment is not None else None,
+        }, status=status.HTTP_201_CREATED)
+    
+    def get_bulk_rows(self, request):
+        if isinstance(request.data, list):
+            rows = request.data
+        else:
+            candidates = request.data.get('candidates')
+            if candidates is None:
+                raise exceptions.ValidationError({'candidates': 'This field is required'})
+            
+            if hasattr(candidates, 'read'):
+                data_format = request.data.get('format', candidates.name.rsplit('.', 1)[-1])
+                rows = parse_candidate_rows(candidates.read().decode('utf-8-sig'), data_format.lower())
+            else:
+                rows = parse_candidate_rows(candidates, request.data.get('format', 'json').lower())
+        
+        # Images are matched with their candidate by the name of the uploaded file field
+        for row in rows:
+            if isinstance(row, dict) and isinstance(row.get('img_path'), str) and row['img_path'] in request.FILES:
+                row['img_path'] = request.FILES[row['img_path']]
+        
+        return rows
     
     def destroy(self, request, *args, **kwargs):
         ballot = shortcuts.get_object_or_404(BallotBox, id=kwargs['bk'])
         if ballot.start_datetime < datetime.now(timezone.utc):
             return response.Response("Votation " + str(ballot.id) + " has started and can't be changed", status.HTTP_409_CONFLICT)
+        if ballot.finalized:
+            return response.Response("Votation " + str(ballot.id) + " has been finalized and can't be changed", status.HTTP_409_CONFLICT)
         return super().destroy(request, *args, **kwargs)
-    
+
 # Instead of inherit from ModelViewSet, we inherit from only necesary mixins
 
-class ContractView(mixins.RetrieveModelMixin,
+class ContractView(ReplicaReadMixin,
+                   mixins.RetrieveModelMixin,
                    viewsets.GenericViewSet):
     queryset = BallotBox.objects.all()
     serializer_class = BallotBoxContractAddressSerializer
     permission_classes = [permissions.IsAdminUser|permissions.IsAuthenticatedOrReadOnly]
     authentication_classes = [authentication.SessionAuthentication, authentication.TokenAuthentication]
-    
\ No newline at end of file
+
+
+class DeploymentJobView(mixins.RetrieveModelMixin,
+                        viewsets.GenericViewSet):
+    queryset = DeploymentJob.objects.all()
+    serializer_class = DeploymentJobSerializer
+    permission_classes = [permissions.IsAdminUser|permissions.IsAuthenticatedOrReadOnly]
+    authentication_classes = [authentication.SessionAuthentication, authentication.TokenAuthentication]
@@ -2,6 +2,7 @@
 ASGI config for ballot_mgmt project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides the Django application, it serves the live results stream of the ballots.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -13,4 +14,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ballot_mgmt.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, as it uses the models
+from api.streams import ResultsStreamRouter
+
+application = ResultsStreamRouter(django_application)
@@ -25,10 +25,19 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(find_dotenv())
 SECRET_KEY = os.environ['SECRET_KEY']
 
+# Settings profile: dev (the default, for local development), test (set by manage.py test) or prod (set by the
+# Docker image). Debug mode, template loading, API renderers, sessions and logging depend on it
+PROFILE = os.environ.get('DJANGO_PROFILE', 'dev')
+
+if PROFILE not in ('dev', 'test', 'prod'):
+    raise ValueError('DJANGO_PROFILE must be dev, test or prod')
+
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Debug mode also keeps every query run in memory, so long running processes grow with each request
+DEBUG = PROFILE == 'dev'
 
-ALLOWED_HOSTS = []
+# Comma separated, needed in prod (in dev, localhost is allowed)
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('ALLOWED_HOSTS', '').split(',') if host.strip()]
 
 
 # Application definition
@@ -51,17 +60,24 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'ballot_mgmt.urls'
 
+# Templates (admin, login and browsable API pages) are compiled once and kept in memory, except in dev so changes
+# to them show up without restarting
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -69,6 +85,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': TEMPLATE_LOADERS if PROFILE == 'dev' else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
         },
     },
 ]
@@ -78,14 +95,211 @@ WSGI_APPLICATION = 'ballot_mgmt.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
+# Postgres when POSTGRES_NAME is set (as docker-compose does), SQLite otherwise. SQLite only allows one writer at a
+# time, so it's only meant for development with a single worker
+# Each worker thread keeps its connection open for DB_CONN_MAX_AGE seconds (0 closes it after every request, None never
+# does) and checks it's still usable before reusing it. Under ASGI every request runs in its own thread, so connections
+# can't be reused between requests: put a pooler (pgbouncer, with DB_POOLER set) between the workers and Postgres. The
+# pooler keeps the real connections open and limits how many of them reach Postgres
+
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '60')
+
+if os.environ.get('POSTGRES_NAME'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_NAME'],
+            'USER': os.environ.get('POSTGRES_USER', ''),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE),
+            'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+            # A pooler in transaction mode may run each transaction on a different server connection, where the
+            # cursors of the previous one don't exist
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER', 'false').lower() == 'true',
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+                # Idle connections are probed, so the ones dropped along the way are found instead of hanging
+                'keepalives': 1,
+                'keepalives_idle': 60,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Read replicas
+# Comma separated hosts of Postgres replicas of the default database (same name, user and password). The ballot list
+# and detail, candidate list and contract address are read from them, everything else from the primary. After a write
+# the client (by a cookie) and the changed ballot read from the primary for DATABASE_REPLICA_PIN_SECONDS, which should
+# be longer than the replication lag
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+POSTGRES_REPLICA_HOSTS = [host.strip() for host in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()]
+
+DATABASE_REPLICAS = []
+
+for number, host in enumerate(POSTGRES_REPLICA_HOSTS):
+    DATABASES['replica_' + str(number)] = {**DATABASES['default'], 'HOST': host}
+    DATABASE_REPLICAS.append('replica_' + str(number))
+
+# Tests read from a replica that mirrors the default database
+if PROFILE == 'test':
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS = ['replica']
+
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', 5))
+
+
+# Blockchain provider
+# WEB3_BACKEND chooses the chain: api.backends.InfuraBackend (Polygon Mumbai through Infura, needs INFURA_API_KEY),
+# api.backends.HTTPBackend (the JSON-RPC nodes in WEB3_PROVIDER_URLS), api.backends.LocalNodeBackend (a local anvil or
+# hardhat node shared by every process, to run deployments, votes and counts without credentials) or
+# api.backends.TesterBackend (a chain inside each process that needs requirements-dev.txt, for tests)
+# Every worker process keeps a single Web3 client with a pool of keep-alive connections
 
-DATABASES = {
+WEB3_BACKEND = os.environ.get('WEB3_BACKEND', 'api.backends.InfuraBackend')
+
+# Comma separated. Requests go to the fastest healthy node, with Infura they are fallbacks
+WEB3_PROVIDER_URLS = [url.strip() for url in os.environ.get('WEB3_PROVIDER_URLS', '').split(',') if url.strip()]
+
+# Seconds a failing node is skipped for, doubled on each consecutive failure up to the maximum
+WEB3_EJECT_BACKOFF = float(os.environ.get('WEB3_EJECT_BACKOFF', 1))
+
+WEB3_EJECT_MAX_BACKOFF = float(os.environ.get('WEB3_EJECT_MAX_BACKOFF', 60))
+
+# Times a transaction is sent (with its nonce read from the chain again) before giving up
+WEB3_SEND_ATTEMPTS = int(os.environ.get('WEB3_SEND_ATTEMPTS', 3))
+
+# Seconds a sent transaction is waited for before it's given up as not mined
+WEB3_RECEIPT_TIMEOUT = int(os.environ.get('WEB3_RECEIPT_TIMEOUT', 600))
+
+# Seconds a worker has to send a deployment it claimed. Deployments claimed before that and still not sent are
+# claimed again, as their worker died
+DEPLOYMENT_CLAIM_TIMEOUT = int(os.environ.get('DEPLOYMENT_CLAIM_TIMEOUT', 300))
+
+WEB3_POOL_SIZE = int(os.environ.get('WEB3_POOL_SIZE', 10))
+
+WEB3_TIMEOUT = int(os.environ.get('WEB3_TIMEOUT', 30))
+
+# Maximum number of contract reads sent at the same time by the async views
+WEB3_CONCURRENCY = int(os.environ.get('WEB3_CONCURRENCY', 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Invalidations (and replica pins) have to reach every process: the app server workers, and the deployer and poller
+# commands, which change ballots too. So prod uses the database cache by default (its table is created by migrate.sh)
+# and refuses the local memory cache, which is per process, when it runs several workers. Dev runs a single process
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache' if PROFILE == 'prod' else 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'api_cache' if CACHE_BACKEND.endswith('.DatabaseCache') else ''),
     }
 }
 
+# Whether the cache is only seen by the process that writes to it
+LOCAL_CACHE = CACHE_BACKEND.endswith('.LocMemCache')
+
+if PROFILE == 'prod' and LOCAL_CACHE and int(os.environ.get('WEB_CONCURRENCY', 2)) > 1:
+    raise ValueError('CACHE_BACKEND must be shared by every process (database, Redis...) when running several workers')
+
+# Tests shouldn't share cached responses between them
+if PROFILE == 'test':
+    CACHES['default'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+# Seconds ballot responses are cached for, and the shorter time used for active ballots (their counts change on chain)
+API_CACHE_TIMEOUT = int(os.environ.get('API_CACHE_TIMEOUT', 300))
+
+API_CACHE_ACTIVE_TIMEOUT = int(os.environ.get('API_CACHE_ACTIVE_TIMEOUT', 5))
+
+# Votes sent just before a ballot ends may still be mined a few blocks later, so its results are only stored and served
+# as final once these seconds have passed since the end. Until then the counts read by the poller are served
+RESULTS_FINALITY_SECONDS = int(os.environ.get('RESULTS_FINALITY_SECONDS', 120))
+
+
+# Live results stream (served by the ASGI application)
+# Each process reads the counts of a ballot once every interval and sends the changes to all of its subscribers.
+# Subscribers are sent a comment every keepalive seconds so proxies don't close idle connections, and a subscriber
+# with more than queue size events pending gets the whole counts instead
+
+RESULTS_STREAM_INTERVAL = float(os.environ.get('RESULTS_STREAM_INTERVAL', 2))
+
+RESULTS_STREAM_KEEPALIVE = float(os.environ.get('RESULTS_STREAM_KEEPALIVE', 15))
+
+RESULTS_STREAM_QUEUE_SIZE = int(os.environ.get('RESULTS_STREAM_QUEUE_SIZE', 16))
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+# The browsable API is only rendered in dev and test, prod only answers JSON
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'] + (
+        ['rest_framework.renderers.BrowsableAPIRenderer'] if PROFILE != 'prod' else []
+    ),
+}
+
+
+# Sessions (of the admin, the browsable API and session authentication)
+# https://docs.djangoproject.com/en/4.0/topics/http/sessions/
+# In prod sessions are read from the cache and only written to the database, as long as the cache is shared: with a
+# per process cache, a logout would only remove the session from the cache of the worker that served it, and the other
+# workers would keep accepting it. Otherwise they are read from the database
+
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db' if PROFILE == 'prod' and not LOCAL_CACHE else 'django.contrib.sessions.backends.db')
+
+
+# Logging
+# https://docs.djangoproject.com/en/4.0/topics/logging/
+# Everything goes to the console. LOG_LEVEL sets the level of the api app, Django itself only logs warnings and errors
+# (except in dev) and tests only log errors
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', {'dev': 'DEBUG', 'test': 'ERROR', 'prod': 'INFO'}[PROFILE])
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {
+            'format': '{asctime} {levelname} {name} {process:d} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'verbose',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['console'],
+            'level': {'dev': 'INFO', 'test': 'ERROR', 'prod': 'WARNING'}[PROFILE],
+            'propagate': False,
+        },
+        'api': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -126,6 +340,9 @@ STATIC_URL = 'static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Uploaded files (candidate images) are served by the app itself unless a proxy in front of it serves MEDIA_ROOT
+SERVE_MEDIA = os.environ.get('SERVE_MEDIA', 'true').lower() == 'true'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
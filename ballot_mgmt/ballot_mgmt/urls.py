@@ -13,10 +13,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.urls import path, include
+from django.urls import path, include, re_path
+from django.views.static import serve
 
 from rest_framework import routers
-from api import views
+from api import async_views, views
 
 from django.conf.urls.static import static
 from django.conf import settings
@@ -25,10 +26,18 @@ router = routers.DefaultRouter(trailing_slash=False)
 router.register(r'ballot', views.BallotBoxView, basename='ballot')
 router.register(r'candidates/(?P<bk>\d+)', views.CandidateView, basename='candidates')
 router.register(r'contract', views.ContractView, basename='contract')
+router.register(r'deployments', views.DeploymentJobView, basename='deployments')
 
 urlpatterns = [
+    # Ballot and candidate reads are served by async views, everything else by the router
+    path('api/ballot/<int:pk>', async_views.ballot_detail),
+    path('api/candidates/<int:bk>', async_views.candidate_list),
     path('api/', include(router.urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# static() only serves uploaded files in debug mode, outside of it they are served by the same view unless disabled
+if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+elif settings.SERVE_MEDIA:
+    urlpatterns += [re_path(r'^' + settings.MEDIA_URL.lstrip('/') + r'(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT})]
\ No newline at end of file
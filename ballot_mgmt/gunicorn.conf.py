@@ -0,0 +1,47 @@
+# Gunicorn settings, read by gunicorn from the working directory. Every value can be changed from the environment
+import multiprocessing
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+
+# Uvicorn workers serve the ASGI application, which also serves the live results stream, and run the sync part of
+# each request in a thread. gthread workers serve the WSGI application instead (without the results stream), with
+# GUNICORN_THREADS threads each
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+
+wsgi_app = 'ballot_mgmt.asgi:application' if worker_class.startswith('uvicorn') else 'ballot_mgmt.wsgi:application'
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Seconds a worker can go silent before it's killed and replaced (with gthread workers, the longest a request can take)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# Seconds workers have to finish their requests when they are restarted or stopped. Results stream clients are
+# disconnected then, and reconnect to another worker
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Workers are restarted after this many requests (spread by the jitter so they don't restart at the same time),
+# which bounds the memory a worker can leak. 0 never restarts them
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# The application (settings, models and contract artifacts) is loaded once before forking the workers, so they start
+# faster, share that memory and a broken deploy fails before any worker is replaced
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+accesslog = '-'
+
+errorlog = '-'
+
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+# Connections opened while loading the application must not be shared by the forked workers
+def post_fork(server, worker):
+    from django.db import connections
+    connections.close_all()
@@ -7,6 +7,9 @@ import sys
 def main():
     """Run administrative tasks."""
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ballot_mgmt.settings')
+    # Tests always run with the test settings profile
+    if sys.argv[1:2] == ['test']:
+        os.environ['DJANGO_PROFILE'] = 'test'
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
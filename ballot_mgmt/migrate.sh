@@ -0,0 +1,8 @@
+# Run once before the app servers start (and on each deploy), so they never run migrations themselves
+python manage.py migrate --no-input
+
+# Table of the database cache shared by every process (does nothing with other cache backends)
+python manage.py createcachetable
+
+# The super user is only created the first time
+python manage.py createsuperuser --no-input || echo "-- Super user already exists --"